@@ -1,5 +1,11 @@
 import eventlet
 eventlet.monkey_patch()
+from eventlet.hubs import trampoline
+from eventlet import tpool
+import eventlet.wsgi
+import eventlet.semaphore
+import eventlet.event
+import eventlet.queue
 
 from flask import Flask, render_template, request, Response, jsonify, redirect, url_for
 from flask_socketio import SocketIO, emit
@@ -17,6 +23,28 @@ import time
 import ptyprocess
 import uuid
 import json
+import csv
+import io
+import math
+import statistics
+import codecs
+import collections
+import mmap
+import re
+import socket
+import sqlite3
+import functools
+import http.client
+import contextlib
+import hashlib
+import itertools
+import bisect
+import base64
+import urllib.request
+import urllib.error
+import hmac
+import greenlet
+import shutil
 
 from flask_cors import CORS
 import google.generativeai as genai
@@ -126,94 +154,72 @@ def handle_run_code(data):
             emit('output', "Error: No code received")
             return
 
-        # 1. Write to /tmp (Safe directory in Docker)
-        source_file = "/tmp/program.cpp"
-        executable = "/tmp/program"
-        
-        with open(source_file, "w") as f:
-            f.write(code)
-
-        # 2. Compile
-        # We capture both stdout and stderr to see compilation errors
-        compile_process = subprocess.run(
-            ["g++", source_file, "-o", executable],
-            capture_output=True,
-            text=True
-        )
+        profile, profile_error = submitted_profile(data)
+        if profile_error:
+            emit('output', f"Error: {profile_error}")
+            return
 
-        if compile_process.returncode != 0:
+        user = request_user(data)
+        if ROLE == 'front':
+            stderr, result = remote_batch_run(code, profile, user)
+        else:
+            stderr, result = local_batch_run(code, profile, user)
+        if result is None:
             # Send compilation error back to client
-            emit('output', f"⚠️ Compilation Error:\n{compile_process.stderr}")
+            emit('output', f"⚠️ Compilation Error:\n{stderr}")
             return
 
-        # 3. Run
-        # Set a timeout so infinite loops don't kill your server
-        run_process = subprocess.run(
-            [executable],
-            capture_output=True,
-            text=True,
-            timeout=5  # 5 second timeout
-        )
-
         # 4. Send Output
-        output = run_process.stdout + run_process.stderr
-        emit('output', output)
+        if result['timedOut']:
+            emit('output', f"⏱️ Error: Execution Timed Out (Limit: {BATCH_TIME_LIMIT}s)")
+            return
+        emit('output', result['stdout'] + result['stderr'])
         print("✅ Output sent to client")
 
-    except subprocess.TimeoutExpired:
-        emit('output', "⏱️ Error: Execution Timed Out (Limit: 5s)")
     except Exception as e:
         print(f"🔥 Server Error: {e}") # Shows in fly logs
         emit('output', f"🔥 Server Error: {str(e)}")
 
-@app.route('/run_code', methods=['POST'])
-def run_code():
-    data = request.json
-    code = data.get('code', '')
-    
-    if not code:
-        return jsonify({'error': 'No code provided'}), 400
-
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.cpp', delete=False) as cpp_file:
-        cpp_file.write(code)
-        cpp_path = cpp_file.name
-
-    exe_path = cpp_path.replace('.cpp', '.out')
-    print(f"Compiling {cpp_path} to {exe_path}")
-
+def local_batch_run(code, profile, user):
+    """Compile and run a program in batch mode here: returns (compile errors, result
+    or None if it didn't compile)"""
+    # 1. Write to a temporary file of its own
+    source_file, executable = write_source(code)
     try:
-        # Compile
-        compile_process = subprocess.run(
-            ['g++', cpp_path, '-o', exe_path, '-std=c++17'],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        # 2. Compile with the same profiles and cache as /run
+        with fair_share_slot(user):
+            ok, stderr = compile_program(source_file, executable, profile)
+        if not ok:
+            return stderr, None
 
-        if compile_process.returncode != 0:
-            return jsonify({
-                'message': 'Compilation failed',
-                'stderr': compile_process.stderr
-            }), 400
-
-        # Start process
-        proc = ptyprocess.PtyProcess.spawn([exe_path])
-        session_id = str(uuid.uuid4())
-        
-        active_processes[session_id] = {
-            'proc': proc,
-            'cpp_path': cpp_path,
-            'exe_path': exe_path,
-            'created_at': time.time()
-        }
-        
-        return jsonify({'sessionId': session_id})
+        # 3. Run with the batch limits, so infinite loops don't kill your server
+        result = replayable_run_batch(executable, '', profile=profile)
+    finally:
+        remove_files(source_file, executable)
+    if not result.get('replayed'):
+        record_usage(user, 'cpu', result['cpuTime'] or 0)
+    return stderr, result
 
-    except Exception as e:
-        if os.path.exists(cpp_path):
-            os.remove(cpp_path)
-        return jsonify({'error': str(e)}), 500
+def remote_batch_run(code, profile, user):
+    """Front side of local_batch_run: a batch /run on the least loaded executor"""
+    address = pick_executor()
+    if not address:
+        raise RuntimeError('No executor available, please try again')
+    conn, response = local_request(
+        address, 'POST', '/run',
+        body=json.dumps({'code': code, 'profile': profile, 'userSessionId': user, 'stdin': ''}),
+        headers={'Content-Type': 'application/json'},
+        timeout=COMPILE_TIMEOUT + BATCH_TIME_LIMIT + 5
+    )
+    try:
+        result = json.loads(response.read())
+    finally:
+        conn.close()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    if response.status != 200:
+        return result.get('stderr', ''), None
+    return '', result
 
 @app.route('/', methods=['GET'])
 def home():
@@ -290,7 +296,8 @@ CORRECTED CODE:
         
         for attempt in range(max_retries):
             try:
-                response = model.generate_content(prompt)
+                # The Gemini client blocks, so keep it off the hub
+                response = tpool.execute(model.generate_content, prompt)
                 break  # Success, exit retry loop
             except Exception as api_error:
                 error_str = str(api_error)
@@ -356,156 +363,3925 @@ CORRECTED CODE:
 # Store active processes: { sessionId: { 'proc': ptyprocess, 'output_queue': [], 'finished': False } }
 active_processes = {}
 
-@app.route('/run', methods=['POST'])
-def run_code_http():
-    data = request.json
-    code = data.get('code', '')
-    
-    if not code:
-        return jsonify({'error': 'No code provided'}), 400
+# Session ids look like '<node>.<worker>.<random>' so any process can tell who owns one.
+# NODE_ID is the Fly machine id when deployed, which is what fly-replay expects.
+NODE_ID = os.environ.get('FLY_MACHINE_ID') or socket.gethostname()
+NODE_URL = os.environ.get('NODE_URL', '')  # Public base URL of this machine, when not on Fly
+ON_FLY = bool(os.environ.get('FLY_MACHINE_ID'))
+WORKER_SOCKET_DIR = '/tmp/cpp_workers'
+EXECUTOR_SOCKET_DIR = '/tmp/cpp_executors'
+FORWARDED_HEADER = 'X-Session-Forwarded'
+CLIENT_HEADER = 'X-Session-Client'  # Address of the original client on forwarded requests
+INTERNAL_ENVIRON_KEY = 'cppclassroom.internal'  # Set on requests that came in over a Unix socket
 
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.cpp', delete=False) as cpp_file:
-        cpp_file.write(code)
-        cpp_path = cpp_file.name
+# ROLE is 'standalone' (serve everything in-process), 'front' (HTTP/SSE only,
+# compile/run work goes to executor daemons) or 'executor' (see executor.py)
+ROLE = os.environ.get('ROLE', 'standalone')
 
-    exe_path = cpp_path.replace('.cpp', '.out')
-    print(f"Compiling {cpp_path} to {exe_path}")
+def worker_id():
+    """Id of the current worker process (gunicorn forks after import, so not a constant)"""
+    return os.getpid()
+
+def worker_socket_path(worker):
+    """Unix socket of a local front worker or executor"""
+    executor_path = os.path.join(EXECUTOR_SOCKET_DIR, f'{worker}.sock')
+    if os.path.exists(executor_path):
+        return executor_path
+    return os.path.join(WORKER_SOCKET_DIR, f'{worker}.sock')
+
+def listener_socket_path():
+    """Unix socket this process serves on"""
+    directory = EXECUTOR_SOCKET_DIR if ROLE == 'executor' else WORKER_SOCKET_DIR
+    return os.path.join(directory, f'{worker_id()}.sock')
+
+def new_session_id():
+    return f'{NODE_ID}.{worker_id()}.{uuid.uuid4().hex}'
 
+def owner_from_session_id(session_id):
+    """Decode the owner embedded in a session id, or None if it isn't one of ours"""
     try:
-        # Compile
-        compile_process = subprocess.run(
-            ['g++', cpp_path, '-o', exe_path, '-std=c++17'],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        node, worker, token = session_id.rsplit('.', 2)
+        worker = int(worker)
+    except ValueError:
+        return None
+    return {'node': node, 'worker': worker, 'address': worker_socket_path(worker), 'url': ''}
 
-        if compile_process.returncode != 0:
-            return jsonify({
-                'message': 'Compilation failed',
-                'stderr': compile_process.stderr
-            }), 400
+class SessionRegistry:
+    """Shared sessionId -> owner map, in SQLite so every worker on the machine sees it"""
 
-        # Start process
-        proc = ptyprocess.PtyProcess.spawn([exe_path])
-        session_id = str(uuid.uuid4())
-        
-        active_processes[session_id] = {
-            'proc': proc,
-            'cpp_path': cpp_path,
-            'exe_path': exe_path,
-            'created_at': time.time()
-        }
-        
-        return jsonify({'sessionId': session_id})
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'session_id TEXT PRIMARY KEY, node TEXT, worker INTEGER, '
+                'address TEXT, url TEXT, created_at REAL)'
+            )
+            db.execute('CREATE TABLE IF NOT EXISTS user_sessions (user TEXT PRIMARY KEY, session_id TEXT)')
 
-    except Exception as e:
-        if os.path.exists(cpp_path):
-            os.remove(cpp_path)
-        return jsonify({'error': str(e)}), 500
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
 
-@app.route('/output/<session_id>', methods=['GET'])
-def get_output(session_id):
-    if session_id not in active_processes:
-        return jsonify({'error': 'Session not found'}), 404
+    def register(self, session_id, owner):
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)',
+                (session_id, owner['node'], owner['worker'], owner['address'], owner['url'], time.time())
+            )
 
-    def generate():
-        session = active_processes[session_id]
-        proc = session['proc']
-        fd = proc.fd
-        
-        msg = 'Connected to terminal session...\r\n'
-        yield f"data: {json.dumps({'output': msg})}\n\n"
+    def lookup(self, session_id):
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT node, worker, address, url FROM sessions WHERE session_id = ?',
+                (session_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {'node': row[0], 'worker': row[1], 'address': row[2], 'url': row[3]}
+
+    def unregister(self, session_id):
+        with self._connect() as db:
+            db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def forget_worker(self, node, worker):
+        """Drop sessions left behind by a previous process with the same pid"""
+        with self._connect() as db:
+            db.execute('DELETE FROM sessions WHERE node = ? AND worker = ?', (node, worker))
+
+    def claim_user(self, user, session_id):
+        """Make session_id the user's running session; returns the one it replaces"""
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT session_id FROM user_sessions WHERE user = ?', (user,)).fetchone()
+            db.execute('INSERT OR REPLACE INTO user_sessions VALUES (?, ?)', (user, session_id))
+        return row[0] if row else None
+
+    def release_user(self, user, session_id):
+        with self._connect() as db:
+            db.execute('DELETE FROM user_sessions WHERE user = ? AND session_id = ?', (user, session_id))
+
+class InMemorySessionRegistry:
+    """Stand-in registry for tests and single-process runs"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.users = {}
+
+    def register(self, session_id, owner):
+        self.sessions[session_id] = dict(owner)
+
+    def lookup(self, session_id):
+        owner = self.sessions.get(session_id)
+        return dict(owner) if owner else None
+
+    def unregister(self, session_id):
+        self.sessions.pop(session_id, None)
+
+    def forget_worker(self, node, worker):
+        for session_id, owner in list(self.sessions.items()):
+            if owner['node'] == node and owner['worker'] == worker:
+                del self.sessions[session_id]
+
+    def claim_user(self, user, session_id):
+        previous = self.users.get(user)
+        self.users[user] = session_id
+        return previous
+
+    def release_user(self, user, session_id):
+        if self.users.get(user) == session_id:
+            del self.users[user]
+
+# SESSION_REGISTRY is 'memory' or the path of the SQLite file shared by the workers
+SESSION_REGISTRY = os.environ.get('SESSION_REGISTRY', '/tmp/cpp_sessions.db')
+if SESSION_REGISTRY == 'memory':
+    session_registry = InMemorySessionRegistry()
+else:
+    session_registry = SessionRegistry(SESSION_REGISTRY)
+
+listener_pid = None
 
+def start_worker_listener():
+    """Serve this worker on a private Unix socket so sibling workers can forward to it"""
+    global listener_pid
+    if listener_pid == worker_id():
+        return None
+    listener_pid = worker_id()
+
+    path = listener_socket_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    session_registry.forget_worker(NODE_ID, listener_pid)
+
+    listener = eventlet.listen(path, family=socket.AF_UNIX)
+    return eventlet.spawn(eventlet.wsgi.server, listener, internal_app, log_output=False)
+
+def internal_app(environ, start_response):
+    """The app as served on the private Unix sockets, the only place sibling
+    processes' forwarding headers are believed"""
+    environ[INTERNAL_ENVIRON_KEY] = True
+    return app(environ, start_response)
+
+def forwarded_request():
+    """Whether the current request was forwarded by a sibling process. Clients on
+    the public listener can send the header too, so it only counts over a Unix socket."""
+    return bool(request.environ.get(INTERNAL_ENVIRON_KEY) and request.headers.get(FORWARDED_HEADER))
+
+@app.before_request
+def ensure_worker_listener():
+    start_worker_listener()
+    start_grade_job_watcher()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to a sibling worker's Unix socket"""
+
+    def __init__(self, path, timeout=10):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'host'}
+
+def forward_to_worker(address):
+    """Proxy the current request to another worker and stream its reply back"""
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+    headers[FORWARDED_HEADER] = str(worker_id())
+    headers[CLIENT_HEADER] = request_client()
+
+    conn = UnixHTTPConnection(address)
+    try:
+        conn.request(request.method, request.full_path, body=request.get_data(), headers=headers)
+        upstream = conn.getresponse()
+    except OSError:
+        conn.close()
+        return None
+    # Output streams can sit idle while the program waits for input
+    conn.sock.settimeout(None)
+
+    def generate():
         try:
-            # Read any buffered output immediately (for fast programs)
-            import fcntl
-            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-            
-            # Give the process a moment to produce output
-            eventlet.sleep(0.05)
-            
-            # Try to read any immediate output
-            try:
-                while True:
-                    data = os.read(fd, 1024)
-                    if data:
-                        output = data.decode(errors='replace')
-                        yield f"data: {json.dumps({'output': output})}\n\n"
-                    else:
-                        break
-            except (OSError, BlockingIOError):
-                pass  # No more immediate data
-            
-            # Now enter the normal polling loop
             while True:
-                if not proc.isalive():
-                    # Process finished, try to read any remaining buffered output
-                    try:
-                        data = os.read(fd, 1024)
-                        if data:
-                            output = data.decode(errors='replace')
-                            yield f"data: {json.dumps({'output': output})}\n\n"
-                    except (OSError, BlockingIOError):
-                        pass
+                chunk = upstream.read1(65536)
+                if not chunk:
                     break
-                
-                r, w, x = select.select([fd], [], [], 0.1)
-                
-                if fd in r:
-                    try:
-                        data = os.read(fd, 1024)
-                        if data:
-                            output = data.decode(errors='replace')
-                            yield f"data: {json.dumps({'output': output})}\n\n"
-                    except OSError:
-                        break
-                
-                eventlet.sleep(0.01)
-            
-            exit_msg = '\r\n\x1b[32mProgram exited.\x1b[0m\r\n'
-            yield f"data: {json.dumps({'output': exit_msg, 'status': 'finished'})}\n\n"
-            
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield chunk
         finally:
-            # Cleanup
-            cleanup_session(session_id)
+            conn.close()
 
-    return Response(generate(), mimetype='text/event-stream')
+    reply_headers = [(k, v) for k, v in upstream.getheaders() if k.lower() not in HOP_BY_HOP_HEADERS]
+    return Response(generate(), status=upstream.status, headers=reply_headers)
 
-@app.route('/input/<session_id>', methods=['POST'])
-def send_input(session_id):
-    if session_id not in active_processes:
+def route_to_owner(session_id):
+    """Send a request for a session we don't hold to the worker or machine that does"""
+    owner = session_owner(session_id)
+    if not owner or (owner['node'] == NODE_ID and owner['worker'] == worker_id()):
         return jsonify({'error': 'Session not found'}), 404
-        
-    data = request.json
-    input_text = data.get('input', '')
-    
-    session = active_processes[session_id]
-    proc = session['proc']
-    
-    if proc.isalive():
-        proc.write(input_text.encode())
-        return jsonify({'status': 'ok'})
+
+    if owner['node'] != NODE_ID:
+        if ON_FLY:
+            # Fly's proxy replays the whole request on the owning machine
+            return Response(status=409, headers={'fly-replay': f"instance={owner['node']}"})
+        if owner['url']:
+            return redirect(owner['url'].rstrip('/') + request.full_path.rstrip('?'), code=307)
+        return jsonify({'error': 'Session is owned by another machine'}), 404
+
+    response = forward_to_worker(owner['address'])
+    if response is None:
+        # Owner worker is gone, and its sessions with it
+        session_registry.unregister(session_id)
+        return jsonify({'error': 'Session not found'}), 404
+    return response
+
+def session_affine(view):
+    """Serve a session request here if we own the session, otherwise route it to the owner"""
+    @functools.wraps(view)
+    def wrapper(session_id, *args, **kwargs):
+        if session_id in active_processes or forwarded_request():
+            return view(session_id, *args, **kwargs)
+        return route_to_owner(session_id)
+    return wrapper
+
+def session_owner(session_id):
+    """Owner of a session. Ids minted on this machine name their owner, so the shared
+    registry, whose SQLite calls block the hub, is only asked about the others."""
+    owner = owner_from_session_id(session_id)
+    if owner and owner['node'] == NODE_ID:
+        return owner
+    return session_registry.lookup(session_id) or owner
+
+def session_owner_address(session_id):
+    """Unix socket of the local process that owns a session we don't hold, if any"""
+    owner = session_owner(session_id)
+    if not owner or owner['node'] != NODE_ID or owner['worker'] == worker_id():
+        return None
+    return owner['address']
+
+def local_request(address, method, path, body=None, headers=None, timeout=10):
+    """Send a request to a local worker or executor and return (connection, response)"""
+    headers = dict(headers or {})
+    headers[FORWARDED_HEADER] = str(worker_id())
+    conn = UnixHTTPConnection(address, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        return conn, conn.getresponse()
+    except OSError:
+        conn.close()
+        raise
+
+def read_sse_events(upstream):
+    """Parse the JSON events out of an SSE response from another process"""
+    buffer = b''
+    while True:
+        chunk = upstream.read1(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        while b'\n\n' in buffer:
+            frame, buffer = buffer.split(b'\n\n', 1)
+            for line in frame.split(b'\n'):
+                if line.startswith(b'data: '):
+                    yield json.loads(line[6:])
+
+EXECUTOR_LOAD_TIMEOUT = 0.5  # seconds
+
+def executor_load(address):
+    """Load score reported by an executor, or None if it doesn't answer"""
+    try:
+        conn, response = local_request(address, 'GET', '/executor/load', timeout=EXECUTOR_LOAD_TIMEOUT)
+    except OSError:
+        return None
+    try:
+        if response.status != 200:
+            return None
+        return json.loads(response.read())['load']
+    except (OSError, ValueError, KeyError):
+        return None
+    finally:
+        conn.close()
+
+def pick_executor():
+    """Unix socket of the least loaded executor daemon, or None if none is up"""
+    try:
+        names = os.listdir(EXECUTOR_SOCKET_DIR)
+    except FileNotFoundError:
+        return None
+
+    best = None
+    for name in names:
+        address = os.path.join(EXECUTOR_SOCKET_DIR, name)
+        load = executor_load(address)
+        if load is not None and (best is None or load < best[0]):
+            best = (load, address)
+    return best[1] if best else None
+
+def executor_placed(view):
+    """On the front process, hand new compile/run work to the least loaded executor"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if ROLE != 'front' or forwarded_request():
+            return view(*args, **kwargs)
+
+        address = pick_executor()
+        response = forward_to_worker(address) if address else None
+        if response is None:
+            return jsonify({'error': 'No executor available, please try again'}), 503
+        return response
+    return wrapper
+
+# In-flight work on this process, reported to the front for placement
+executor_stats = {'compiles': 0}
+
+# Compile admission: a template-heavy compile can take hundreds of MB, so new
+# compiles wait while the machine lacks room for one more, and every compiler runs
+# under an address-space limit. Memory spikes then queue instead of inviting the
+# OOM killer in.
+COMPILE_MEMORY_LIMIT = int(os.environ.get('COMPILE_MEMORY_LIMIT', 768 * 1024 * 1024))  # bytes of address space
+COMPILE_MEMORY_ESTIMATE = 256 * 1024 * 1024  # bytes a compile is assumed to peak at
+COMPILE_MEMORY_RESERVE = 128 * 1024 * 1024  # bytes kept free for the server and running programs
+ADMISSION_POLL = 0.1  # seconds between memory checks while held
+ADMISSION_TIMEOUT = 30  # seconds before a held compile gives up
+ADMISSION_STARTUP = 1.0  # seconds before an admitted compiler shows up in /proc
+COMPILER_PROCESSES = {'g++', 'cc1plus', 'collect2', 'as', 'ld', 'ld.gold', 'ld.lld', 'mold'}
+
+admission_lock = eventlet.semaphore.Semaphore()  # Held compiles are admitted in arrival order
+recent_admissions = collections.deque()
+admission_stats = {'waiting': 0, 'held': 0, 'refused': 0}
+
+class CompileAdmissionError(Exception):
+    pass
+
+def memory_available():
+    """MemAvailable from /proc/meminfo in bytes, or None where there is no such file"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def compiler_processes():
+    """(name, resident bytes) of every compiler process on the machine, from /proc"""
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    found = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/comm') as f:
+                name = f.read().strip()
+            if name not in COMPILER_PROCESSES:
+                continue
+            with open(f'/proc/{pid}/statm') as f:
+                found.append((name, int(f.read().split()[1]) * page_size))
+        except (OSError, ValueError, IndexError):
+            continue  # Exited while we looked
+    return found
+
+def compile_headroom():
+    """Bytes left for another compile once running ones reach their estimated peak.
+    Returns (headroom or None if unknown, whether anything is compiling)."""
+    now = time.time()
+    while recent_admissions and now - recent_admissions[0] > ADMISSION_STARTUP:
+        recent_admissions.popleft()
+
+    available = memory_available()
+    compilers = compiler_processes()
+    if available is None:
+        return None, bool(compilers)
+    # cc1plus is where a compile's memory goes; the driver and linker stay small
+    growth = sum(max(COMPILE_MEMORY_ESTIMATE - rss, 0) for name, rss in compilers if name == 'cc1plus')
+    growth += len(recent_admissions) * COMPILE_MEMORY_ESTIMATE
+    return available - COMPILE_MEMORY_RESERVE - growth, bool(compilers or recent_admissions)
+
+def admit_compile(wait=True):
+    """Wait until the machine has room for another compile. Without wait, refuse
+    straight away instead of holding the compile or queueing behind held ones."""
+    if not wait and admission_lock.locked():
+        # Compiles are already held for memory, this one would only queue behind them
+        admission_stats['refused'] += 1
+        raise CompileAdmissionError('The server is short of memory for compiling, please try again')
+    deadline = time.time() + ADMISSION_TIMEOUT if wait else 0
+    held = False
+    admission_stats['waiting'] += 1
+    try:
+        with admission_lock:
+            while True:
+                headroom, compiling = compile_headroom()
+                # With nothing else compiling, waiting can't free anything up
+                if headroom is None or headroom >= COMPILE_MEMORY_ESTIMATE or not compiling:
+                    break
+                if time.time() > deadline:
+                    admission_stats['refused'] += 1
+                    raise CompileAdmissionError('The server is short of memory for compiling, please try again')
+                if not held:
+                    held = True
+                    admission_stats['held'] += 1
+                eventlet.sleep(ADMISSION_POLL)
+            recent_admissions.append(time.time())
+    finally:
+        admission_stats['waiting'] -= 1
+
+# Priority classes, highest first. Interactive work has a student waiting on it,
+# batch work (grading, bulk jobs) has nobody watching the clock, and speculative
+# builds only warm the cache. Lower classes run niced and at a lower I/O priority,
+# batch compiles queue behind interactive ones for a share of the compile slots,
+# and speculative builds are cancelled whenever real work shows up.
+PRIORITY_CLASSES = ('interactive', 'batch', 'speculative')
+PRIORITY_NICENESS = {'interactive': 0, 'batch': 10, 'speculative': 19}
+PRIORITY_IONICE = {'interactive': [], 'batch': ['-c', '2', '-n', '7'], 'speculative': ['-c', '3']}
+IONICE = shutil.which('ionice')
+TASKSET = shutil.which('taskset')
+ENV = shutil.which('env') or '/usr/bin/env'  # The launcher execs without a PATH search
+
+def submitted_priority(data):
+    """The priority class a request asks for: returns (priority, error message).
+    Clients may lower their own work to batch; speculative is for /compile/speculative."""
+    priority = data.get('priority') or 'interactive'
+    if priority not in ('interactive', 'batch'):
+        return None, f"Unknown priority: {priority}, choose interactive or batch"
+    return priority, None
+
+def priority_command(argv, priority):
+    """Prefix a command with the niceness and I/O class of its priority"""
+    prefix = []
+    if PRIORITY_NICENESS[priority]:
+        prefix += ['nice', '-n', str(PRIORITY_NICENESS[priority])]
+    if PRIORITY_IONICE[priority] and IONICE:
+        prefix += [IONICE] + PRIORITY_IONICE[priority]
+    return prefix + list(argv)
+
+def pinned_command(argv, cpu):
+    """Prefix a command with taskset to keep it on one core, when a core is given"""
+    if cpu is None or not TASKSET:
+        return list(argv)
+    return [TASKSET, '-c', str(cpu)] + list(argv)
+
+@contextlib.contextmanager
+def counting_compile(priority='interactive'):
+    """Count a compile towards this process's load, then admit it. A real compile
+    preempts any speculative build running here before it waits for admission.
+    Speculative compiles don't count, and are refused rather than held."""
+    if priority == 'speculative':
+        admit_compile(wait=False)
+        yield
+        return
+    executor_stats['compiles'] += 1
+    try:
+        preempt_speculative_build()
+        admit_compile()
+        yield
+    finally:
+        executor_stats['compiles'] -= 1
+
+def compiler_command(argv, priority='interactive'):
+    """Compiler argv under the address-space limit (inherited by cc1plus and the
+    linker) and its priority class"""
+    return priority_command(['prlimit', f'--as={COMPILE_MEMORY_LIMIT}', '--'] + argv, priority)
+
+@app.route('/executor/load', methods=['GET'])
+def executor_load_report():
+    # A compile costs a full core for a while, an idle session costs almost nothing
+    sessions = len(active_processes)
+    compiles = executor_stats['compiles']
+    return jsonify({
+        'sessions': sessions,
+        'compiles': compiles,
+        'load': sessions + 4 * compiles,
+        'admission': admission_stats,
+        'compilerRssKb': sum(rss for name, rss in compiler_processes()) // 1024
+    })
+
+def serve_executor():
+    """Main loop of an executor daemon: serve the app on this process's Unix socket only"""
+    print(f"Executor {worker_id()} listening on {listener_socket_path()}")
+    listener = start_worker_listener()
+    start_grade_job_watcher()
+    listener.wait()
+
+# Fair share: compile time and program CPU time are accounted per user over sliding
+# windows. When every compile slot is taken, the waiting user with the least
+# weighted recent usage goes next, and programs of users past their share of the
+# CPU run at a higher niceness.
+FAIR_SHARE_SLOTS = int(os.environ.get('FAIR_SHARE_SLOTS', os.cpu_count() or 2))  # concurrent compiles
+BATCH_COMPILE_SLOTS = max(FAIR_SHARE_SLOTS // 2, 1)  # of those, at most this many batch ones
+FAIR_SHARE_WINDOW = 300  # seconds of usage that decide the order
+USAGE_WINDOWS = {'1m': 60, '5m': 300}
+# FAIR_SHARE_WEIGHTS="user=2,other=0.5": a weight of 2 gets twice the share
+FAIR_SHARE_WEIGHTS = {
+    user: float(weight)
+    for user, _, weight in (item.partition('=') for item in os.environ.get('FAIR_SHARE_WEIGHTS', '').split(',') if '=' in item)
+}
+STATS_INTERVAL = 1  # seconds between samples of running sessions
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+
+usage_events = collections.defaultdict(collections.deque)  # user -> (time, kind, seconds)
+fair_share = {'running': 0, 'batch': 0}
+fair_share_waiters = []  # [arrival, user, priority, event]
+fair_share_arrivals = itertools.count()
+
+ADDRESS_USER_PREFIX = 'address:'  # Users known only by their client address
+
+def request_client():
+    """Address of the client, as seen by the first process it reached"""
+    if forwarded_request() and request.headers.get(CLIENT_HEADER):
+        return request.headers[CLIENT_HEADER]
+    if ON_FLY:
+        # remote_addr is Fly's proxy, the same for everyone; the proxy names the client
+        last_hop = request.headers.get('X-Forwarded-For', '').split(',')[-1].strip()
+        return request.headers.get('Fly-Client-IP') or last_hop or request.remote_addr or ''
+    return request.remote_addr or ''
+
+def request_user(data):
+    """Who a request is on behalf of: the client's userSessionId, else its address"""
+    return data.get('userSessionId') or ADDRESS_USER_PREFIX + request_client()
+
+def record_usage(user, kind, seconds):
+    """Account a compile ('compile') or program CPU time ('cpu') to a user"""
+    usage_events[user].append((time.time(), kind, seconds))
+
+def user_usage(user, window):
+    """A user's compiles, compile seconds and CPU seconds over the last window seconds"""
+    events = usage_events.get(user)
+    now = time.time()
+    # Nothing older than the longest window is ever asked for
+    while events and now - events[0][0] > max(USAGE_WINDOWS.values()):
+        events.popleft()
+    if events is not None and not events:
+        del usage_events[user]
+
+    usage = {'compiles': 0, 'compileSeconds': 0.0, 'cpuSeconds': 0.0}
+    for when, kind, seconds in events or ():
+        if now - when > window:
+            continue
+        if kind == 'compile':
+            usage['compiles'] += 1
+            usage['compileSeconds'] += seconds
+        else:
+            usage['cpuSeconds'] += seconds
+    usage['compileSeconds'] = round(usage['compileSeconds'], 3)
+    usage['cpuSeconds'] = round(usage['cpuSeconds'], 3)
+    return usage
+
+def weighted_usage(user):
+    usage = user_usage(user, FAIR_SHARE_WINDOW)
+    return (usage['compileSeconds'] + usage['cpuSeconds']) / FAIR_SHARE_WEIGHTS.get(user, 1.0)
+
+def slot_free(priority):
+    """Whether a compile of this class could start now; batch compiles leave
+    slots free for interactive ones"""
+    if fair_share['running'] >= FAIR_SHARE_SLOTS:
+        return False
+    return priority == 'interactive' or fair_share['batch'] < BATCH_COMPILE_SLOTS
+
+def grant_fair_share_slots():
+    """Hand free slots to waiters: higher classes first, then the lightest user,
+    then the oldest request"""
+    while fair_share_waiters:
+        eligible = [waiter for waiter in fair_share_waiters if slot_free(waiter[2])]
+        if not eligible:
+            return
+        waiter = min(eligible, key=lambda w: (PRIORITY_CLASSES.index(w[2]), weighted_usage(w[1]), w[0]))
+        fair_share_waiters.remove(waiter)
+        take_fair_share_slot(waiter[2])
+        waiter[3].send()
+
+def take_fair_share_slot(priority):
+    fair_share['running'] += 1
+    if priority != 'interactive':
+        fair_share['batch'] += 1
+
+def release_fair_share_slot(priority):
+    fair_share['running'] -= 1
+    if priority != 'interactive':
+        fair_share['batch'] -= 1
+    grant_fair_share_slots()
+
+@contextlib.contextmanager
+def fair_share_slot(user, priority='interactive'):
+    """Hold one of this process's compile slots for a user, queueing by class and fair share"""
+    waiter = [next(fair_share_arrivals), user, priority, eventlet.event.Event()]
+    fair_share_waiters.append(waiter)
+    grant_fair_share_slots()
+    try:
+        waiter[3].wait()
+    except BaseException:
+        if waiter in fair_share_waiters:
+            fair_share_waiters.remove(waiter)
+        else:
+            release_fair_share_slot(priority)  # Handed a slot just as we gave up
+        raise
+
+    started = time.time()
+    try:
+        yield
+    finally:
+        record_usage(user, 'compile', time.time() - started)
+        release_fair_share_slot(priority)
+
+def fair_share_niceness(user, users):
+    """Niceness for a user's programs among the users running programs here:
+    0 within their fair share, 5 past it, 10 past twice it"""
+    usage = {other: weighted_usage(other) for other in users}
+    total = sum(usage.values())
+    if len(usage) < 2 or not total:
+        return 0
+    ratio = usage[user] / (total / len(usage))
+    if ratio <= 1:
+        return 0
+    return 5 if ratio <= 2 else 10
+
+def session_processes(leaders):
+    """(pid, session id, /proc/<pid>/stat fields after the name) of every process
+    in the sessions led by the given launcher pids, the launchers excluded"""
+    for name in os.listdir('/proc'):
+        if not name.isdigit() or int(name) in leaders:
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue  # Exited while we were looking
+        if int(fields[3]) in leaders:
+            yield int(name), int(fields[3]), fields
+
+def sample_sessions(sessions):
+    """Resource use of each session's program, from one pass over /proc.
+
+    A session runs under the launcher, which leads its own session id, so every
+    process the program forks is found by that id. Returns {launcher pid:
+    {'cpuTime', 'rssKb', 'threads', 'processes'}}, sessions whose program has
+    already exited are missing.
+    """
+    samples = {}
+    for pid, sid, fields in session_processes({session['proc'].pid for session in sessions}):
+        sample = samples.setdefault(sid, {'cpuTime': 0.0, 'rssKb': 0, 'threads': 0, 'processes': 0})
+        # Reaped children count towards their parent's cutime and cstime
+        sample['cpuTime'] += sum(int(x) for x in fields[11:15]) / CLOCK_TICKS
+        sample['rssKb'] += int(fields[21]) * PAGE_SIZE_KB
+        sample['threads'] += int(fields[17])
+        sample['processes'] += 1
+    return samples
+
+def update_session_stats(session, sample, now):
+    """Fold a sample into a session's live stats and charge new CPU time to its user"""
+    stats = session['stats']
+    cpu = max(sample['cpuTime'], stats['cpuTime'])
+    elapsed = now - session['sampled_at']
+    stats.update(
+        cpuTime=round(cpu, 3),
+        cpuPercent=round(100 * (cpu - stats['cpuTime']) / elapsed, 1) if elapsed > 0 else 0.0,
+        rssKb=sample['rssKb'],
+        peakRssKb=max(stats['peakRssKb'], sample['rssKb']),
+        threads=sample['threads'],
+        processes=sample['processes']
+    )
+    session['sampled_at'] = now
+    session['stats_seq'] += 1
+    if cpu > session['cpu_accounted']:
+        record_usage(session['user'], 'cpu', cpu - session['cpu_accounted'])
+        session['cpu_accounted'] = cpu
+
+def account_session(session):
+    """Take a last sample of a session before it goes away"""
+    sample = sample_sessions([session]).get(session['proc'].pid)
+    if sample:
+        update_session_stats(session, sample, time.time())
+
+def monitor_sessions():
+    """Sample running sessions, charge their users and renice programs by fair share"""
+    while active_processes:
+        eventlet.sleep(STATS_INTERVAL)
+        sessions = list(active_processes.values())
+        samples = sample_sessions(sessions)
+        now = time.time()
+        for session in sessions:
+            if session['proc'].pid in samples:
+                update_session_stats(session, samples[session['proc'].pid], now)
+
+        users = {session['user'] for session in sessions}
+        for session in sessions:
+            niceness = fair_share_niceness(session['user'], users)
+            if niceness != session['niceness']:
+                try:
+                    # The whole process group, so forked children are reniced too
+                    os.setpriority(os.PRIO_PGRP, session['proc'].pid, niceness)
+                    session['niceness'] = niceness
+                except OSError:
+                    pass  # Exited, or lowering niceness needs privileges we lack
+    session_monitor['thread'] = None
+
+session_monitor = {'thread': None}
+
+@app.route('/usage', methods=['GET'])
+def usage_report():
+    """Per-user usage over each window and live stats of each running session;
+    users and sessions appear as a short hash of their id"""
+    if ROLE == 'front' and not forwarded_request():
+        return jsonify(merged_executor_usage())
+    users = {}
+    for user in list(usage_events):
+        windows = {name: user_usage(user, seconds) for name, seconds in USAGE_WINDOWS.items()}
+        if any(usage['compiles'] or usage['cpuSeconds'] for usage in windows.values()):
+            users[hashlib.sha256(user.encode()).hexdigest()[:12]] = windows
+    sessions = [{
+        'session': hashlib.sha256(session_id.encode()).hexdigest()[:12],
+        'user': hashlib.sha256(session['user'].encode()).hexdigest()[:12] if session['user'] else None,
+        'uptime': round(time.time() - session['created_at'], 1),
+        'niceness': session['niceness'],
+        **session['stats']
+    } for session_id, session in list(active_processes.items())]
+    return jsonify({
+        'users': users,
+        'sessions': sessions,
+        'compileSlots': FAIR_SHARE_SLOTS,
+        'compilesRunning': fair_share['running'],
+        'batchCompilesRunning': fair_share['batch'],
+        'compilesWaiting': len(fair_share_waiters)
+    })
+
+def merged_executor_usage():
+    """/usage of every executor, summed"""
+    merged = {'users': {}, 'sessions': [], 'compileSlots': 0, 'compilesRunning': 0, 'batchCompilesRunning': 0, 'compilesWaiting': 0}
+    try:
+        names = os.listdir(EXECUTOR_SOCKET_DIR)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        try:
+            conn, response = local_request(os.path.join(EXECUTOR_SOCKET_DIR, name), 'GET', '/usage', timeout=2)
+            report = json.loads(response.read())
+            conn.close()
+        except (OSError, ValueError):
+            continue
+        for key in ('compileSlots', 'compilesRunning', 'batchCompilesRunning', 'compilesWaiting'):
+            merged[key] += report[key]
+        merged['sessions'].extend(report.get('sessions', []))
+        for user, windows in report['users'].items():
+            mine = merged['users'].setdefault(user, {})
+            for window, usage in windows.items():
+                total = mine.setdefault(window, {'compiles': 0, 'compileSeconds': 0.0, 'cpuSeconds': 0.0})
+                for key, value in usage.items():
+                    total[key] += value
+    return merged
+
+# Limits for batch (non-PTY) runs
+BATCH_TIME_LIMIT = 5  # seconds of wall time
+BATCH_CPU_LIMIT = 5  # seconds of CPU time
+BATCH_MEMORY_LIMIT = 256 * 1024 * 1024  # bytes of address space
+BATCH_OUTPUT_LIMIT = 1024 * 1024  # bytes kept per stream
+
+# Build profiles: named, server-defined compiler flags. Their flags are part of every
+# cache key, and results report the profile used.
+LANGUAGE_FLAGS = ['-std=c++17']
+
+def fast_linker_flags():
+    """Use the fastest linker installed; linking is a big share of an -O0 build"""
+    for linker in ('mold', 'lld', 'gold'):
+        if shutil.which(f'ld.{linker}') or shutil.which(linker):
+            return [f'-fuse-ld={linker}']
+    return []
+
+BUILD_PROFILES = {
+    'quick': LANGUAGE_FLAGS + ['-O0', '-pipe'] + fast_linker_flags(),
+    'optimized': LANGUAGE_FLAGS + ['-O2', '-pipe'],
+    'aggressive': LANGUAGE_FLAGS + ['-O3', '-pipe'],
+    'sanitize': LANGUAGE_FLAGS + ['-O1', '-g', '-fsanitize=address,undefined', '-fno-omit-frame-pointer'],
+    'profiling': LANGUAGE_FLAGS + ['-O2', '-g', '-pg'],
+}
+DEFAULT_PROFILE = 'quick'
+
+def submitted_profile(data):
+    """The build profile a request asks for: returns (profile, error message)"""
+    profile = data.get('profile') or DEFAULT_PROFILE
+    if profile not in BUILD_PROFILES:
+        return None, f"Unknown profile: {profile}, choose one of {', '.join(BUILD_PROFILES)}"
+    return profile, None
+
+def profile_run_limits(profile, memory_limit=BATCH_MEMORY_LIMIT):
+    """(address space limit, extra environment) for running a binary built with a profile.
+    AddressSanitizer reserves terabytes of shadow memory, so sanitized programs get
+    its own RSS limit instead of an address-space one."""
+    if profile == 'sanitize':
+        return 0, {'ASAN_OPTIONS': f'hard_rss_limit_mb={memory_limit >> 20}'}
+    return memory_limit, {}
+
+# Small C launcher that applies limits and reports the program's own rusage
+LAUNCHER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launcher.c')
+LAUNCHER_PATH = '/tmp/cpp_launcher'
+# Allocation counter preloaded into programs that ask for a heap report
+HEAP_TRACKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'heaptrack.c')
+HEAP_TRACKER_PATH = '/tmp/cpp_heaptrack.so'
+helper_lock = threading.Lock()
+
+def build_helper(source, path, flags=()):
+    """Build a C helper once and reuse it until its source changes"""
+    with helper_lock:
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+            return path
+        tmp_path = f'{path}.{os.getpid()}'
+        subprocess.run(['gcc', '-O2', *flags, source, '-o', tmp_path],
+                       check=True, capture_output=True, timeout=30)
+        os.replace(tmp_path, path)
+        return path
+
+def ensure_launcher():
+    return build_helper(LAUNCHER_SOURCE, LAUNCHER_PATH)
+
+def ensure_heap_tracker():
+    return build_helper(HEAP_TRACKER_SOURCE, HEAP_TRACKER_PATH, ['-shared', '-fPIC'])
+
+def launcher_command(argv, report_fd=-1, cpu_limit=BATCH_CPU_LIMIT, memory_limit=BATCH_MEMORY_LIMIT):
+    """Prefix a command with the launcher and its limits"""
+    return [ensure_launcher(), str(report_fd), str(cpu_limit), str(memory_limit)] + list(argv)
+
+def heap_tracking_command(argv, report_fd):
+    """Preload the heap tracker into a command. `env` sets the variables for the
+    program alone, so a launcher in front of it runs untracked."""
+    return [ENV, f'LD_PRELOAD={ensure_heap_tracker()}', f'HEAPTRACK_FD={report_fd}'] + list(argv)
+
+def parse_heap_report(data):
+    """Parse the heap tracker's report line, or None if the program didn't exit normally"""
+    try:
+        peak, allocations, frees, leaked, leaked_blocks = (int(x) for x in data.split())
+    except ValueError:
+        return None
+    return {'peakBytes': peak, 'allocations': allocations, 'frees': frees,
+            'leakedBytes': leaked, 'leakedBlocks': leaked_blocks}
+
+def submitted_heap_tracking(data, profile):
+    """Whether a request asks for a heap report: returns (track heap, error message)"""
+    track_heap = bool(data.get('trackHeap'))
+    if track_heap and profile == 'sanitize':
+        # ASan replaces the allocator itself and must come first in the library list
+        return False, 'trackHeap cannot be combined with the sanitize profile'
+    return track_heap, None
+
+def parse_launcher_report(data):
+    """Parse the launcher's report line into (wait status, cpu seconds, peak rss kb)"""
+    try:
+        status, utime, stime, maxrss = (int(x) for x in data.split())
+    except ValueError:
+        return None
+    return status, (utime + stime) / 1e6, maxrss
+
+def run_batch(exe_path, stdin_data, stdin_path=None, profile=DEFAULT_PROFILE, priority='interactive',
+              time_limit=BATCH_TIME_LIMIT, cpu_limit=BATCH_CPU_LIMIT, memory_limit=BATCH_MEMORY_LIMIT,
+              stdout_consumer=None, cpu=None, env=None, track_heap=False):
+    """Run a program on plain pipes with pre-supplied stdin and collect everything.
+
+    stdin_path, when given, is sent into the pipe with sendfile instead of stdin_data.
+    stdout_consumer, when given, sees every chunk of stdout, past the output limit
+    too; returning False stops the program there and sets `stopped` in the result.
+    cpu, when given, pins the program to that core. env adds to the program's environment.
+    track_heap preloads the heap tracker and adds its report as `heap`.
+    """
+    memory_limit, profile_env = profile_run_limits(profile, memory_limit)
+    report_r, report_w = os.pipe()
+    os.set_blocking(report_r, False)  # Green os.read only yields on non-blocking fds
+    heap_r, heap_w = os.pipe() if track_heap else (None, None)
+    argv = [exe_path]
+    if track_heap:
+        os.set_blocking(heap_r, False)
+        argv = heap_tracking_command(argv, heap_w)
+    started = time.time()
+    try:
+        proc = subprocess.Popen(
+            pinned_command(priority_command(launcher_command(
+                argv, report_fd=report_w, cpu_limit=math.ceil(cpu_limit), memory_limit=memory_limit
+            ), priority), cpu),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=(report_w, heap_w) if track_heap else (report_w,),
+            start_new_session=True,
+            env=dict(os.environ, **profile_env, **(env or {}))
+        )
+    except BaseException:
+        if track_heap:
+            os.close(heap_r)
+        raise
+    finally:
+        os.close(report_w)
+        if track_heap:
+            os.close(heap_w)
+
+    captured = {'stdout': bytearray(), 'stderr': bytearray(), 'report': b'', 'heap': b'',
+                'truncated': False, 'stopped': False}
+
+    def feed():
+        try:
+            if stdin_path:
+                sendfile_all(proc.stdin.fileno(), stdin_path)
+            elif stdin_data:
+                proc.stdin.write(stdin_data.encode())
+        except (BrokenPipeError, OSError):
+            pass  # Program exited without reading all of its input
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    def drain(fd, name):
+        # Keep reading past the limit so the child never blocks on a full pipe
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            if name == 'stdout' and stdout_consumer and not captured['stopped'] and stdout_consumer(data) is False:
+                # The launcher passes SIGTERM on to the program and still reports its
+                # rusage; the time limit takes care of a program that ignores it
+                captured['stopped'] = True
+                try:
+                    os.kill(proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            room = BATCH_OUTPUT_LIMIT - len(captured[name])
+            if room > 0:
+                captured[name] += data[:room]
+            if len(data) > room:
+                captured['truncated'] = True
+
+    def read_report(fd, name):
+        captured[name] = os.read(fd, 256)
+
+    workers = [
+        eventlet.spawn(feed),
+        eventlet.spawn(drain, proc.stdout.fileno(), 'stdout'),
+        eventlet.spawn(drain, proc.stderr.fileno(), 'stderr'),
+        eventlet.spawn(read_report, report_r, 'report')
+    ]
+    if track_heap:
+        workers.append(eventlet.spawn(read_report, heap_r, 'heap'))
+
+    timed_out = False
+    try:
+        while proc.poll() is None:
+            if time.time() - started > time_limit:
+                timed_out = True
+                kill_process_group(proc)
+                break
+            eventlet.sleep(0.005)
+    except BaseException:
+        # Abandoned (the client went away): don't leave the program running
+        kill_process_group(proc)
+        for worker in workers:
+            worker.kill()
+        proc.stdout.close()
+        proc.stderr.close()
+        os.close(report_r)
+        if track_heap:
+            os.close(heap_r)
+        raise
+    wall_time = time.time() - started
+
+    # Orphaned grandchildren could keep the pipes open, so don't wait forever
+    with eventlet.Timeout(1, False):
+        for worker in workers:
+            worker.wait()
+    for worker in workers:
+        worker.kill()
+    proc.stdout.close()
+    proc.stderr.close()
+    os.close(report_r)
+    if track_heap:
+        os.close(heap_r)
+
+    result = {
+        'status': 'finished',
+        'stdout': captured['stdout'].decode(errors='replace'),
+        'stderr': captured['stderr'].decode(errors='replace'),
+        'exitCode': None,
+        'signal': signal.SIGKILL.value if timed_out else None,
+        'timedOut': timed_out,
+        'truncated': captured['truncated'],
+        'stopped': captured['stopped'],
+        'wallTime': round(wall_time, 4),
+        'cpuTime': None,
+        'peakMemoryKb': None
+    }
+
+    report = parse_launcher_report(captured['report'])
+    if report:
+        status, cpu_time, peak_rss = report
+        result['exitCode'] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else None
+        result['signal'] = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+        result['cpuTime'] = round(cpu_time, 4)
+        result['peakMemoryKb'] = peak_rss
+    if track_heap:
+        result['heap'] = parse_heap_report(captured['heap'])
+    return result
+
+def kill_process_group(proc):
+    """SIGKILL a program started in its own session, with anything it forked, and reap it"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    proc.wait()
+
+def remove_files(*paths):
+    """Remove temporary build files (or project directories) if they exist"""
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+COMPILE_TIMEOUT = 10  # seconds
+
+# Remote compile workers (see compile_worker.py), as comma-separated base URLs
+COMPILE_WORKERS = [url.rstrip('/') for url in os.environ.get('COMPILE_WORKERS', '').split(',') if url.strip()]
+HASH_RING_REPLICAS = 64  # virtual nodes per worker, evens out the key spread
+WORKER_RETRY_DELAY = 10  # seconds before probing a worker that failed
+WORKER_PROBE_TIMEOUT = 0.5  # seconds
+MAX_WORKER_ATTEMPTS = 2
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], 'big')
+
+def build_hash_ring(workers):
+    """Consistent hash ring: sorted (point, worker) pairs with several points per worker"""
+    return sorted((ring_hash(f'{worker}#{i}'), worker) for worker in workers for i in range(HASH_RING_REPLICAS))
+
+compile_ring = build_hash_ring(COMPILE_WORKERS)
+compile_ring_points = [point for point, worker in compile_ring]
+# { worker url: time before which it is considered down }
+worker_down_until = {}
+
+def ring_workers(key):
+    """Workers in ring order for a key: its owner first, then the fallbacks"""
+    if not compile_ring:
+        return []
+    start = bisect.bisect(compile_ring_points, ring_hash(key))
+    ordered = []
+    for i in range(len(compile_ring)):
+        worker = compile_ring[(start + i) % len(compile_ring)][1]
+        if worker not in ordered:
+            ordered.append(worker)
+    return ordered
+
+def worker_available(worker):
+    """False while a failed worker is cooling down; after that, probe its /health"""
+    down_until = worker_down_until.get(worker)
+    if down_until is None:
+        return True
+    if time.time() < down_until:
+        return False
+    try:
+        with urllib.request.urlopen(f'{worker}/health', timeout=WORKER_PROBE_TIMEOUT) as response:
+            healthy = response.status == 200
+    except OSError:
+        healthy = False
+    if healthy:
+        del worker_down_until[worker]
     else:
-        return jsonify({'error': 'Process finished'}), 400
+        worker_down_until[worker] = time.time() + WORKER_RETRY_DELAY
+    return healthy
 
-def cleanup_session(session_id):
-    if session_id in active_processes:
-        session = active_processes[session_id]
-        proc = session['proc']
-        proc.terminate(force=True)
-        
-        if os.path.exists(session['exe_path']):
-            os.remove(session['exe_path'])
-        if os.path.exists(session['cpp_path']):
-            os.remove(session['cpp_path'])
-            
-        del active_processes[session_id]
+def remote_compile(cpp_path, exe_path, flags):
+    """Compile on the worker pool. Returns (ok, stderr), or None to compile locally"""
+    if not COMPILE_WORKERS:
+        return None
+
+    with open(cpp_path) as f:
+        source = f.read()
+    key = hashlib.sha256(source.encode()).hexdigest()
+    body = json.dumps({'source': source, 'flags': flags}).encode()
+
+    attempts = 0
+    for worker in ring_workers(key):
+        if attempts >= MAX_WORKER_ATTEMPTS:
+            break
+        if not worker_available(worker):
+            continue
+        attempts += 1
+
+        req = urllib.request.Request(f'{worker}/compile', data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=COMPILE_TIMEOUT + 5) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 422:
+                # The worker compiled it and g++ said no, that's the answer
+                return False, json.loads(e.read()).get('stderr', '')
+            print(f"Compile worker {worker} failed: {e}")
+            worker_down_until[worker] = time.time() + WORKER_RETRY_DELAY
+            continue
+        except (OSError, ValueError) as e:
+            print(f"Compile worker {worker} failed: {e}")
+            worker_down_until[worker] = time.time() + WORKER_RETRY_DELAY
+            continue
+
+        with open(exe_path, 'wb') as f:
+            f.write(base64.b64decode(result['binary']))
+        os.chmod(exe_path, 0o755)
+        return True, result.get('stderr', '')
+
+    return None
+
+# Compile cache: L1 is a directory on this machine, L2 an optional content-addressed
+# HTTP blob store shared by all machines (see cache_server.py)
+LOCAL_CACHE_DIR = '/tmp/cpp_compile_cache'
+LOCAL_CACHE_MAX_ENTRIES = 500
+L2_CACHE_URL = os.environ.get('L2_CACHE_URL', '').rstrip('/')
+L2_CACHE_SECRET = os.environ.get('L2_CACHE_SECRET', '')  # Signs blobs so other writers can't poison them
+L2_FETCH_TIMEOUT = 1.0  # seconds, past this compiling ourselves is the faster option
+L2_STORE_TIMEOUT = 10  # seconds, stores happen in the background
+L2_RETRY_DELAY = 10  # seconds before going back to L2 after it failed
+
+compile_cache_stats = {
+    'exactHits': 0, 'normalizedHits': 0, 'misses': 0,
+    'l2Hits': 0, 'l2Errors': 0, 'preprocessHits': 0,
+    'objectHits': 0, 'objectMisses': 0,
+    'speculativeBuilds': 0, 'speculativeCancelled': 0,
+    'lintChecks': 0, 'lintHits': 0, 'lintSuperseded': 0,
+    'runReplays': 0, 'runRecordings': 0, 'profileReplays': 0, 'profileRecordings': 0
+}
+
+l2_down_until = {'time': 0.0}
+
+def compile_cache_key(source, flags):
+    return hashlib.sha256(json.dumps([compiler_identity(), flags, source]).encode()).hexdigest()
+
+def blob_signature(key, digest):
+    return hmac.new(L2_CACHE_SECRET.encode(), f'{key}:{digest}'.encode(), hashlib.sha256).hexdigest()
+
+def pack_build(exe_path, stderr):
+    """Blob stored in L2: a JSON header line with the warnings, then the binary"""
+    with open(exe_path, 'rb') as f:
+        return json.dumps({'stderr': stderr}).encode() + b'\n' + f.read()
+
+def unpack_build(blob, exe_path):
+    header, binary = blob.split(b'\n', 1)
+    with open(exe_path, 'wb') as f:
+        f.write(binary)
+    os.chmod(exe_path, 0o755)
+    return json.loads(header)['stderr']
+
+def install_cached_binary(cached_path, exe_path):
+    """Put a cached binary at exe_path, sharing the inode when we can"""
+    try:
+        os.link(cached_path, exe_path)
+    except OSError:
+        shutil.copy2(cached_path, exe_path)
+
+def l1_lookup(key, exe_path):
+    """Warnings of an L1 hit installed at exe_path, or None"""
+    binary_path = os.path.join(LOCAL_CACHE_DIR, key)
+    try:
+        with open(f'{binary_path}.json') as f:
+            stderr = json.load(f)['stderr']
+        install_cached_binary(binary_path, exe_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    os.utime(binary_path)  # Keep recently used entries away from eviction
+    return stderr
+
+def l1_store(key, exe_path, stderr):
+    os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
+    binary_path = os.path.join(LOCAL_CACHE_DIR, key)
+    tmp = f'{binary_path}.{os.getpid()}.tmp'
+    shutil.copy2(exe_path, tmp)
+    os.replace(tmp, binary_path)
+    with open(f'{tmp}.json', 'w') as f:
+        json.dump({'stderr': stderr}, f)
+    os.replace(f'{tmp}.json', f'{binary_path}.json')
+    evict_local_cache()
+
+def evict_local_cache():
+    """Drop the least recently used binaries once L1 holds too many"""
+    entries = [e for e in os.scandir(LOCAL_CACHE_DIR) if '.' not in e.name]
+    if len(entries) <= LOCAL_CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - LOCAL_CACHE_MAX_ENTRIES]:
+        for path in (entry.path, f'{entry.path}.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def l2_available():
+    return L2_CACHE_URL and time.time() >= l2_down_until['time']
+
+def l2_failed():
+    """Count an L2 error and leave L2 alone for a while, so a slow or dead store
+    doesn't add its timeout to every compile"""
+    compile_cache_stats['l2Errors'] += 1
+    l2_down_until['time'] = time.time() + L2_RETRY_DELAY
+
+def l2_fetch(key):
+    """Verified L2 blob of a key, or None"""
+    if not l2_available():
+        return None
+    try:
+        with urllib.request.urlopen(f'{L2_CACHE_URL}/blobs/{key}', timeout=L2_FETCH_TIMEOUT) as response:
+            blob = response.read()
+            digest = response.headers.get('X-Content-SHA256', '')
+            signature = response.headers.get('X-Signature', '')
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            l2_failed()
+        return None
+    except OSError:
+        l2_failed()
+        return None
+
+    # Never run a binary we can't vouch for
+    if hashlib.sha256(blob).hexdigest() != digest:
+        print(f"L2 cache blob {key} failed its digest check")
+        compile_cache_stats['l2Errors'] += 1
+        return None
+    if L2_CACHE_SECRET and not hmac.compare_digest(signature, blob_signature(key, digest)):
+        print(f"L2 cache blob {key} has a bad signature")
+        compile_cache_stats['l2Errors'] += 1
+        return None
+    return blob
+
+def l2_lookup(lookups):
+    """Fetch (key, path) pairs from L2 in one concurrent round, so a miss waits on
+    L2 once however many keys it tries. Installs the first hit for each path there
+    and returns {key: warnings} of the hits installed."""
+    if not lookups or not l2_available():
+        return {}
+    pool = eventlet.GreenPool(len(lookups))
+    hits = {}
+    installed = set()
+    for (key, path), blob in zip(lookups, pool.imap(l2_fetch, [key for key, path in lookups])):
+        if blob is None or path in installed:
+            continue
+        try:
+            stderr = unpack_build(blob, path)
+        except (OSError, ValueError, KeyError):
+            compile_cache_stats['l2Errors'] += 1
+            continue
+        l1_store(key, path, stderr)
+        compile_cache_stats['l2Hits'] += 1
+        installed.add(path)
+        hits[key] = stderr
+    return hits
+
+def l2_store(key, blob):
+    """Upload a build to L2; runs in the background so compiles never wait on it"""
+    digest = hashlib.sha256(blob).hexdigest()
+    headers = {'Content-Type': 'application/octet-stream', 'X-Content-SHA256': digest}
+    if L2_CACHE_SECRET:
+        headers['X-Signature'] = blob_signature(key, digest)
+    req = urllib.request.Request(f'{L2_CACHE_URL}/blobs/{key}', data=blob, headers=headers, method='PUT')
+    try:
+        with urllib.request.urlopen(req, timeout=L2_STORE_TIMEOUT):
+            pass
+    except OSError as e:
+        l2_failed()
+        print(f"L2 cache store of {key} failed: {e}")
+
+# Normalized keys hash the preprocessed translation unit with whitespace collapsed,
+# so comments, reindenting and blank lines don't change them (like ccache's
+# preprocessor mode). CACHE_KEY_MODE=exact turns them off.
+CACHE_KEY_MODE = os.environ.get('CACHE_KEY_MODE', 'preprocessed')
+PREPROCESS_TIMEOUT = 5  # seconds
+PREPROCESS_CACHE_SIZE = 1000
+
+def embeds_source_lines(flags):
+    """Whether binaries built with these flags report source lines themselves (debug
+    info, sanitizers, profiling), so a build of shifted text would point at the wrong ones"""
+    return any(flag in ('-g', '-pg') or flag.startswith('-fsanitize') for flag in flags)
+
+# Literals are kept verbatim. Whitespace between tokens is dropped where it can't
+# matter and collapsed to one space where it can (x y, a - -b), except newlines
+# around #pragma lines, which end the directive.
+TOKEN_PATTERN = re.compile(
+    r'R"([^()\\\s]{0,16})\(.*?\)\1"'
+    r'|"(?:\\.|[^"\\\n])*"'
+    r"|'(?:\\.|[^'\\\n])*'"
+    r'|\s+',
+    re.S
+)
+STANDALONE_PUNCTUATION = set('()[]{};,')  # Never part of a longer token
+
+preprocessed_keys = collections.OrderedDict()  # exact key -> normalized key
+
+def is_word_char(char):
+    return char.isalnum() or char in '_"\''
+
+def normalize_tokens(text):
+    def collapse(match):
+        token = match.group(0)
+        if not token.isspace():
+            return token
+        start, end = match.span()
+        before = text[start - 1] if start else ''
+        after = text[end] if end < len(text) else ''
+        line_start = text.rfind('\n', 0, start) + 1
+        if '\n' in token and (after == '#' or text[line_start:start].lstrip().startswith('#')):
+            return '\n'
+        if not before or not after or before in STANDALONE_PUNCTUATION or after in STANDALONE_PUNCTUATION:
+            return ''
+        return ' ' if is_word_char(before) == is_word_char(after) else ''
+    return TOKEN_PATTERN.sub(collapse, text)
+
+@functools.lru_cache(maxsize=1)
+def compiler_identity():
+    """Preprocessed output only pins a binary down for one compiler version"""
+    return subprocess.run(['g++', '--version'], capture_output=True, text=True).stdout
+
+def normalized_cache_key(source, flags, priority='interactive'):
+    """Key of the preprocessed, token-normalized source, or None when it doesn't preprocess"""
+    exact = compile_cache_key(source, flags)
+    if exact in preprocessed_keys:
+        preprocessed_keys.move_to_end(exact)
+        compile_cache_stats['preprocessHits'] += 1
+        return preprocessed_keys[exact]
+
+    try:
+        with counting_compile(priority):
+            # From stdin, so __FILE__ doesn't carry the per-run temp path into the key
+            proc = subprocess.run(
+                compiler_command(['g++', '-E', '-P', '-x', 'c++', '-'] + flags, priority),
+                input=source,
+                capture_output=True,
+                text=True,
+                timeout=PREPROCESS_TIMEOUT
+            )
+    except subprocess.TimeoutExpired:
+        return None
+    if proc.returncode != 0:
+        return None
+
+    key = hashlib.sha256(json.dumps(
+        ['preprocessed', compiler_identity(), flags, normalize_tokens(proc.stdout)]
+    ).encode()).hexdigest()
+    preprocessed_keys[exact] = key
+    if len(preprocessed_keys) > PREPROCESS_CACHE_SIZE:
+        preprocessed_keys.popitem(last=False)
+    return key
+
+def lookup_build(cpp_path, flags, exe_path, priority='interactive'):
+    """Look a build up by exact key, then by normalized key: both in L1, then both
+    in L2 at once. Returns (warnings or None on a miss, keys to store a fresh build under)"""
+    with open(cpp_path) as f:
+        source = f.read()
+    keys = {'exact': compile_cache_key(source, flags)}
+
+    stderr = l1_lookup(keys['exact'], exe_path)
+    if stderr is not None:
+        compile_cache_stats['exactHits'] += 1
+        return stderr, keys
+
+    if CACHE_KEY_MODE == 'preprocessed' and not embeds_source_lines(flags):
+        keys['normalized'] = normalized_cache_key(source, flags, priority)
+        stderr = l1_lookup(keys['normalized'], exe_path) if keys['normalized'] else None
+        if stderr is not None:
+            compile_cache_stats['normalizedHits'] += 1
+            # The next run of this exact text then skips preprocessing altogether
+            l1_store(keys['exact'], exe_path, stderr)
+            return stderr, keys
+
+    hits = l2_lookup([(key, exe_path) for key in keys.values() if key])
+    if keys['exact'] in hits:
+        compile_cache_stats['exactHits'] += 1
+        return hits[keys['exact']], keys
+    if keys.get('normalized') in hits:
+        compile_cache_stats['normalizedHits'] += 1
+        stderr = hits[keys['normalized']]
+        l1_store(keys['exact'], exe_path, stderr)
+        return stderr, keys
+
+    compile_cache_stats['misses'] += 1
+    return None, keys
+
+def cache_store(keys, exe_path, stderr):
+    """Store a fresh build in L1 now and in L2 behind the caller's back"""
+    store_keys = [keys['exact']]
+    # Warnings point at lines of this exact text, so only clean builds are shared
+    # with its cosmetic variants
+    if keys.get('normalized') and not stderr:
+        store_keys.append(keys['normalized'])
+
+    for key in store_keys:
+        try:
+            l1_store(key, exe_path, stderr)
+            if l2_available():
+                eventlet.spawn(l2_store, key, pack_build(exe_path, stderr))
+        except OSError as e:
+            print(f"Compile cache store of {key} failed: {e}")
+
+def compile_program(cpp_path, exe_path, profile=DEFAULT_PROFILE, priority='interactive'):
+    """Compile a source file, on the worker pool when there is one. Returns (ok, stderr)"""
+    if os.path.isdir(cpp_path):
+        return final_value(project_compile_events(cpp_path, exe_path, priority, profile))
+
+    flags = BUILD_PROFILES[profile]
+    stderr, keys = lookup_build(cpp_path, flags, exe_path, priority)
+    if stderr is not None:
+        return True, stderr
+
+    result = remote_compile(cpp_path, exe_path, flags)
+    if result is None:
+        with counting_compile(priority):
+            compile_process = subprocess.run(
+                compiler_command(['g++', cpp_path, '-o', exe_path] + flags, priority),
+                capture_output=True,
+                text=True,
+                timeout=COMPILE_TIMEOUT
+            )
+        result = compile_process.returncode == 0, compile_process.stderr
+
+    ok, stderr = result
+    if ok:
+        cache_store(keys, exe_path, stderr)
+    return result
+
+@app.route('/cache/stats', methods=['GET'])
+def compile_cache_report():
+    if ROLE == 'front' and not forwarded_request():
+        return jsonify(merged_executor_cache_stats())
+    return jsonify(compile_cache_stats)
+
+def merged_executor_cache_stats():
+    """/cache/stats of every executor, summed"""
+    merged = dict.fromkeys(compile_cache_stats, 0)
+    try:
+        names = os.listdir(EXECUTOR_SOCKET_DIR)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        try:
+            conn, response = local_request(os.path.join(EXECUTOR_SOCKET_DIR, name), 'GET', '/cache/stats', timeout=2)
+            report = json.loads(response.read())
+            conn.close()
+        except (OSError, ValueError):
+            continue
+        for key, value in report.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+# Multi-file projects: each translation unit is compiled to its own object, cached
+# under its content plus the project headers it includes, and the binary under the
+# set of objects, so a run only recompiles the units that changed
+PROJECT_MAX_FILES = 32
+PROJECT_FILE_NAME = re.compile(r'[A-Za-z0-9_][A-Za-z0-9_.-]{0,63}')
+SOURCE_EXTENSIONS = ('.cpp', '.cc', '.cxx')
+HEADER_EXTENSIONS = ('.h', '.hpp', '.hh', '.hxx')
+PROJECT_COMPILE_JOBS = os.cpu_count() or 2
+INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*"([^"]+)"', re.M)
+
+def submitted_program(data):
+    """The code or project a run request carries: returns (code, error message)"""
+    files = data.get('files')
+    if files is None:
+        code = data.get('code', '')
+        return (code, None) if code else (None, 'No code provided')
+
+    if not isinstance(files, dict) or not files:
+        return None, 'No files provided'
+    if len(files) > PROJECT_MAX_FILES:
+        return None, f'Too many files, the limit is {PROJECT_MAX_FILES}'
+    for name, source in files.items():
+        if not PROJECT_FILE_NAME.fullmatch(name) or not name.endswith(SOURCE_EXTENSIONS + HEADER_EXTENSIONS):
+            return None, f'Invalid file name: {name}'
+        if not isinstance(source, str):
+            return None, f'Invalid contents for {name}'
+    if not any(name.endswith(SOURCE_EXTENSIONS) for name in files):
+        return None, 'No source files provided'
+    return files, None
+
+def read_project(project_dir):
+    files = {}
+    for name in os.listdir(project_dir):
+        if name.endswith(SOURCE_EXTENSIONS + HEADER_EXTENSIONS):
+            with open(os.path.join(project_dir, name)) as f:
+                files[name] = f.read()
+    return files
+
+def included_headers(files, name):
+    """Project headers a file includes, directly or through other headers"""
+    seen = set()
+    pending = [name]
+    while pending:
+        for include in INCLUDE_PATTERN.findall(files[pending.pop()]):
+            header = os.path.normpath(include)
+            if header in files:
+                if header not in seen:
+                    seen.add(header)
+                    pending.append(header)
+            elif os.path.basename(header) in files:
+                # An include we can't resolve by name may still reach a project
+                # header, so key on all of them rather than risk a stale object
+                return sorted(n for n in files if n.endswith(HEADER_EXTENSIONS))
+    return sorted(seen)
+
+def object_cache_key(files, name, flags):
+    headers = {header: files[header] for header in included_headers(files, name)}
+    return hashlib.sha256(json.dumps(
+        ['object', compiler_identity(), flags, name, files[name], headers]
+    ).encode()).hexdigest()
+
+def object_path(project_dir, name):
+    return os.path.join(project_dir, f'{name}.o')
+
+def compile_object(project_dir, name, flags, priority='interactive'):
+    """Compile one translation unit of a project to its object file. Returns (ok, stderr)"""
+    try:
+        with counting_compile(priority):
+            proc = subprocess.run(
+                # Relative names keep the temp dir out of the diagnostics
+                compiler_command(['g++', '-c', name, '-o', f'{name}.o', '-fdiagnostics-color=never'] + flags, priority),
+                capture_output=True,
+                text=True,
+                timeout=COMPILE_TIMEOUT,
+                cwd=project_dir
+            )
+    except subprocess.TimeoutExpired:
+        return False, f'{name}: compilation timed out after {COMPILE_TIMEOUT} seconds\n'
+    return proc.returncode == 0, proc.stderr
+
+def project_compile_events(project_dir, exe_path, priority='interactive', profile=DEFAULT_PROFILE):
+    """compile_events for a project directory: cached objects are reused, the rest
+    compiled in parallel, and the binary relinked only when an object changed.
+
+    Returns (ok, stderr) with the warnings of every unit.
+    """
+    started = time.time()
+    flags = BUILD_PROFILES[profile]
+    files = read_project(project_dir)
+    units = sorted(name for name in files if name.endswith(SOURCE_EXTENSIONS))
+    keys = {name: object_cache_key(files, name, flags) for name in units}
+    link_keys = {'exact': hashlib.sha256(json.dumps(
+        ['link', flags, [keys[name] for name in units]]
+    ).encode()).hexdigest()}
+
+    # L1 for the binary and every unit, then whatever L1 lacks from L2 in one round
+    stderr = l1_lookup(link_keys['exact'], exe_path)
+    warnings = {}
+    if stderr is None:
+        for name in units:
+            cached = l1_lookup(keys[name], object_path(project_dir, name))
+            if cached is not None:
+                warnings[name] = cached
+        lookups = [(link_keys['exact'], exe_path)]
+        lookups += [(keys[name], object_path(project_dir, name)) for name in units if name not in warnings]
+        hits = l2_lookup(lookups)
+        stderr = hits.get(link_keys['exact'])
+        warnings.update((name, hits[keys[name]]) for name in units if keys[name] in hits)
+
+    if stderr is not None:
+        compile_cache_stats['exactHits'] += 1
+        for line in stderr.splitlines(keepends=True):
+            yield {'diagnostic': line}
+        yield {'status': 'compiled', 'profile': profile, 'compileTime': round(time.time() - started, 3), 'cached': True}
+        return True, stderr
+    compile_cache_stats['misses'] += 1
+
+    stale = [name for name in units if name not in warnings]
+    compile_cache_stats['objectHits'] += len(units) - len(stale)
+    compile_cache_stats['objectMisses'] += len(stale)
+
+    ok = True
+    pool = eventlet.GreenPool(PROJECT_COMPILE_JOBS)
+    results = pool.imap(lambda name: compile_object(project_dir, name, flags, priority), stale)
+    try:
+        for name, (unit_ok, unit_stderr) in zip(stale, results):
+            warnings[name] = unit_stderr
+            for line in unit_stderr.splitlines(keepends=True):
+                yield {'diagnostic': line}
+            if unit_ok:
+                cache_store({'exact': keys[name]}, object_path(project_dir, name), unit_stderr)
+            ok = ok and unit_ok
+    finally:
+        # Cancelled or abandoned: don't leave unit compiles running
+        for thread in list(pool.coroutines_running):
+            thread.kill()
+
+    stderr = ''.join(warnings[name] for name in units)
+    if not ok:
+        return False, stderr
+
+    try:
+        with counting_compile(priority):
+            link = subprocess.run(
+                compiler_command(['g++'] + [f'{name}.o' for name in units] + ['-o', exe_path] + flags, priority),
+                capture_output=True,
+                text=True,
+                timeout=COMPILE_TIMEOUT,
+                cwd=project_dir
+            )
+    except subprocess.TimeoutExpired:
+        return False, stderr + f'Linking timed out after {COMPILE_TIMEOUT} seconds\n'
+    for line in link.stderr.splitlines(keepends=True):
+        yield {'diagnostic': line}
+    stderr += link.stderr
+    if link.returncode != 0:
+        return False, stderr
+
+    cache_store(link_keys, exe_path, stderr)
+    yield {
+        'status': 'compiled',
+        'profile': profile,
+        'compileTime': round(time.time() - started, 3),
+        'objects': {'compiled': len(stale), 'reused': len(units) - len(stale)}
+    }
+    return True, stderr
+
+def final_value(events):
+    """Run an event generator to the end for its return value"""
+    while True:
+        try:
+            next(events)
+        except StopIteration as done:
+            return done.value
+
+# Run results: a program that can't tell one run from the next (it calls nothing
+# that reads the clock, randomness, files or the process id, and starts no
+# threads) gives the same output for the same input. Such runs are recorded once
+# and replayed after: batch results keyed on the binary, stdin and limits, and the
+# terminal output of sessions that ended on their own without any input typed.
+# RUN_CACHE=off turns this off.
+RUN_CACHE = os.environ.get('RUN_CACHE', 'on') != 'off'
+RUN_CACHE_DIR = '/tmp/cpp_run_cache'
+RUN_CACHE_MAX_ENTRIES = 1000
+RUN_CACHE_MAX_OUTPUT = 1024 * 1024  # bytes of session output worth recording
+SYMBOL_VERDICT_CACHE_SIZE = 1000
+# Imports (from nm -D) that make a run depend on more than its binary and stdin
+NONDETERMINISTIC_SYMBOL = re.compile(
+    r'(time|times|ftime|clock|clock_gettime|gettimeofday|localtime\w*|gmtime\w*|'
+    r'rand|rand_r|random|srand|srandom|[dejlmn]rand48\w*|getrandom|getentropy|arc4random\w*|'
+    r'getpid|getppid|gettid|pthread_create|fork|vfork|system|popen|execv\w*|ioctl|'
+    r'fopen\w*|freopen\w*|open|open64|openat\w*|opendir|syscall)'
+    r'|.*(clock3now|random_device|St6thread|basic_i?o?fstream|basic_filebuf).*'
+)
+
+run_cache_symbol_verdicts = collections.OrderedDict()  # binary hash -> replayable
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def replayable_binary(exe_path, binary_hash):
+    """Whether a binary imports nothing that could make two runs differ"""
+    if binary_hash in run_cache_symbol_verdicts:
+        run_cache_symbol_verdicts.move_to_end(binary_hash)
+        return run_cache_symbol_verdicts[binary_hash]
+    try:
+        proc = subprocess.run(['nm', '-D', '--undefined-only', exe_path], capture_output=True, text=True, timeout=5)
+        symbols = [line.split()[-1].split('@')[0] for line in proc.stdout.splitlines() if line.strip()]
+        replayable = proc.returncode == 0 and not any(NONDETERMINISTIC_SYMBOL.fullmatch(s) for s in symbols)
+    except (OSError, subprocess.TimeoutExpired):
+        replayable = False
+    run_cache_symbol_verdicts[binary_hash] = replayable
+    while len(run_cache_symbol_verdicts) > SYMBOL_VERDICT_CACHE_SIZE:
+        run_cache_symbol_verdicts.popitem(last=False)
+    return replayable
+
+def run_cache_key(exe_path, *context):
+    """Key of a run of this binary in this context, or None if its runs can't be replayed"""
+    if not RUN_CACHE or os.path.isdir(exe_path):
+        return None
+    binary_hash = file_digest(exe_path)
+    if not replayable_binary(exe_path, binary_hash):
+        return None
+    return hashlib.sha256(json.dumps([binary_hash, *context]).encode()).hexdigest()
+
+def run_cache_path(key):
+    return os.path.join(RUN_CACHE_DIR, key)
+
+def run_cache_lookup(key, counter='runReplays'):
+    """Path of a recorded run, or None"""
+    path = run_cache_path(key)
+    try:
+        os.utime(path)  # Keep recently replayed runs away from eviction
+    except OSError:
+        return None
+    compile_cache_stats[counter] += 1
+    return path
+
+def run_cache_store(key, data, counter='runRecordings'):
+    os.makedirs(RUN_CACHE_DIR, exist_ok=True)
+    tmp = f'{run_cache_path(key)}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, run_cache_path(key))
+    compile_cache_stats[counter] += 1
+
+    entries = [e for e in os.scandir(RUN_CACHE_DIR) if '.' not in e.name]
+    if len(entries) > RUN_CACHE_MAX_ENTRIES:
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - RUN_CACHE_MAX_ENTRIES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def replayable_run_batch(exe_path, stdin_data, stdin_path=None, profile=DEFAULT_PROFILE, priority='interactive',
+                         track_heap=False):
+    """run_batch, replaying the recorded result of an identical earlier run when there is one"""
+    key = None
+    if RUN_CACHE and not track_heap and not os.path.isdir(exe_path):
+        stdin_hash = file_digest(stdin_path) if stdin_path else hashlib.sha256(stdin_data.encode()).hexdigest()
+        limits = [BATCH_TIME_LIMIT, BATCH_CPU_LIMIT, BATCH_MEMORY_LIMIT, BATCH_OUTPUT_LIMIT]
+        key = run_cache_key(exe_path, 'batch', stdin_hash, profile, limits)
+    if key:
+        path = run_cache_lookup(key)
+        if path:
+            with open(path) as f:
+                return {**json.load(f), 'replayed': True}
+
+    result = run_batch(exe_path, stdin_data, stdin_path=stdin_path, profile=profile, priority=priority,
+                       track_heap=track_heap)
+    # Only clean exits: a crash or timeout can depend on the machine as much as the program
+    if key and result['exitCode'] == 0 and not result['timedOut']:
+        run_cache_store(key, json.dumps(result).encode())
+    return result
+
+def session_recording_key(exe_path):
+    return run_cache_key(exe_path, 'session')
+
+def finish_recording(session):
+    """Keep a session's output for replay if the program ran to a clean exit
+    without ever being given input"""
+    recording = session['recording']
+    proc = session['proc']
+    if recording is None or session['stdin_used'] or recording['overflow']:
+        return
+    try:
+        proc.wait()
+    except ptyprocess.PtyProcessError:
+        pass
+    if proc.exitstatus == 0:
+        run_cache_store(recording['key'], bytes(recording['output']))
+
+def write_source(code):
+    """Write code to a temporary .cpp file and return (cpp_path, exe_path).
+    A project (dict of file name -> source) gets a directory instead of the .cpp file."""
+    if isinstance(code, dict):
+        project_dir = tempfile.mkdtemp(suffix='.proj')
+        for name, source in code.items():
+            with open(os.path.join(project_dir, name), 'w') as f:
+                f.write(source)
+        return project_dir, f'{project_dir}.out'
+
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.cpp', delete=False) as cpp_file:
+        cpp_file.write(code)
+        cpp_path = cpp_file.name
+    return cpp_path, cpp_path.replace('.cpp', '.out')
+
+def start_session(cpp_path, exe_path, user='', track_heap=False):
+    """Spawn the compiled program on a PTY and register it as a session.
+    A user has one running session; starting another stops the previous one. Users
+    known only by their address don't, since one address can be a whole classroom.
+    track_heap preloads the heap tracker, whose report joins the summary at exit."""
+    # A replay has no heap to report on, so tracked runs always run for real
+    key = session_recording_key(exe_path) if not track_heap else None
+    replay = run_cache_lookup(key) if key else None
+    if replay:
+        # Output is recorded after the terminal's newline translation, don't apply it twice
+        argv = ['sh', '-c', 'stty -opost && exec cat "$0"', replay]
+    else:
+        argv = [exe_path]
+
+    # Under the launcher, whose wait4 rusage becomes the summary at exit
+    report_r, report_w = os.pipe()
+    heap_r, heap_w = os.pipe() if track_heap else (None, None)
+    pass_fds = (report_w, heap_w) if track_heap else (report_w,)
+    for fd in (report_r, heap_r):
+        if fd is not None:
+            os.set_blocking(fd, False)
+    for fd in pass_fds:
+        os.set_inheritable(fd, True)  # ptyprocess keeps pass_fds open but doesn't mark them
+    if track_heap:
+        argv = heap_tracking_command(argv, heap_w)
+    try:
+        proc = ptyprocess.PtyProcess.spawn(
+            launcher_command(argv, report_fd=report_w, cpu_limit=0, memory_limit=0),
+            pass_fds=pass_fds
+        )
+    except BaseException:
+        os.close(report_r)
+        if track_heap:
+            os.close(heap_r)
+        raise
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+    session_id = new_session_id()
+
+    # Reads and writes on the PTY must never block the hub
+    flags = fcntl.fcntl(proc.fd, fcntl.F_GETFL)
+    fcntl.fcntl(proc.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    active_processes[session_id] = {
+        'proc': proc,
+        'cpp_path': cpp_path,
+        'exe_path': exe_path,
+        'created_at': time.time(),
+        'input_queue': collections.deque(),
+        'input_pending': 0,
+        'input_writer': None,
+        'user': user,
+        'cpu_accounted': 0.0,
+        'niceness': 0,
+        'report_fd': report_r,
+        'heap_fd': heap_r,
+        'stats': {'cpuTime': 0.0, 'cpuPercent': 0.0, 'rssKb': 0, 'peakRssKb': 0, 'threads': 0, 'processes': 0},
+        'stats_seq': 0,
+        'sampled_at': time.time(),
+        'summary': None,
+        'stdin_used': False,
+        'recording': {'key': key, 'output': bytearray(), 'overflow': False} if key and not replay else None
+    }
+    session_registry.register(session_id, {
+        'node': NODE_ID,
+        'worker': worker_id(),
+        'address': worker_socket_path(worker_id()),
+        'url': NODE_URL
+    })
+
+    if user and not user.startswith(ADDRESS_USER_PREFIX):
+        previous = session_registry.claim_user(user, session_id)
+        if previous and previous != session_id:
+            stop_session(previous)
+    if session_monitor['thread'] is None:
+        session_monitor['thread'] = eventlet.spawn(monitor_sessions)
+    return session_id
+
+INPUT_QUEUE_LIMIT = 1024 * 1024  # bytes of typed stdin held in memory per session
+INPUT_WRITE_CHUNK = 4096  # bytes handed to the PTY per write
+
+def queue_input(session_id, data):
+    """Queue stdin for a session and return how many bytes were accepted.
+
+    The bytes are written by a per-session writer that only runs while the
+    PTY is writable, so a program that stops reading never blocks the caller.
+    """
+    session = active_processes[session_id]
+    accepted = data[:max(0, INPUT_QUEUE_LIMIT - session['input_pending'])]
+    if accepted:
+        queue = session['input_queue']
+        if queue and isinstance(queue[-1], bytearray):
+            queue[-1] += accepted  # Coalesce with input that is still waiting
+        else:
+            queue.append(bytearray(accepted))
+        session['input_pending'] += len(accepted)
+        session['stdin_used'] = True
+        wake_input_writer(session)
+    return len(accepted)
+
+def queue_input_file(session_id, path):
+    """Queue a file to be streamed to a session's stdin straight from a memory map"""
+    session = active_processes[session_id]
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    session['input_queue'].append({'map': mapped, 'offset': 0})
+    session['stdin_used'] = True
+    wake_input_writer(session)
+    return size
+
+def wake_input_writer(session):
+    """Start the session's stdin writer unless it is already running"""
+    writer = session['input_writer']
+    if writer is None or writer.dead:
+        session['input_writer'] = eventlet.spawn(drain_input, session)
+
+def drain_input(session):
+    """Write a session's queued stdin to its PTY, waiting for writability as needed"""
+    queue = session['input_queue']
+    fd = session['proc'].fd
+    try:
+        while queue:
+            segment = queue[0]
+            if isinstance(segment, bytearray):
+                # Bursts that queued up while we waited go out in a single write
+                written = os.write(fd, bytes(segment[:INPUT_WRITE_CHUNK]))
+                del segment[:written]
+                session['input_pending'] -= written
+                if not segment:
+                    queue.popleft()
+            else:
+                # Only the pages being written are touched, memory stays flat
+                mapped = segment['map']
+                offset = segment['offset']
+                written = os.write(fd, mapped[offset:offset + INPUT_WRITE_CHUNK])
+                segment['offset'] += written
+                if segment['offset'] >= len(mapped):
+                    mapped.close()
+                    queue.popleft()
+    except OSError:
+        clear_input_queue(session)  # Program is gone
+
+def clear_input_queue(session):
+    """Drop a session's queued stdin and release any mapped files"""
+    for segment in session['input_queue']:
+        if isinstance(segment, dict):
+            segment['map'].close()
+    session['input_queue'].clear()
+    session['input_pending'] = 0
+
+UPLOAD_DIR = '/tmp/cpp_inputs'
+MAX_UPLOAD_SIZE = 256 * 1024 * 1024  # bytes
+UPLOAD_TTL = 60 * 60  # seconds an uploaded input is kept
+UPLOAD_CHUNK = 1024 * 1024
+
+def input_file_path(input_id):
+    """Path of an uploaded input, or None if the id is malformed or unknown"""
+    if not re.fullmatch(r'[0-9a-f]{32}', input_id or ''):
+        return None
+    path = os.path.join(UPLOAD_DIR, input_id)
+    return path if os.path.exists(path) else None
+
+def purge_uploads():
+    """Remove uploaded inputs older than UPLOAD_TTL"""
+    cutoff = time.time() - UPLOAD_TTL
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def sendfile_all(out_fd, path):
+    """Copy a file into a pipe with sendfile, yielding to the hub when the pipe is full"""
+    with open(path, 'rb') as f:
+        in_fd = f.fileno()
+        size = os.fstat(in_fd).st_size
+        offset = 0
+        while offset < size:
+            try:
+                sent = os.sendfile(out_fd, in_fd, offset, UPLOAD_CHUNK)
+            except BlockingIOError:
+                trampoline(out_fd, write=True)
+                continue
+            if sent == 0:
+                break
+            offset += sent
+
+@app.route('/run', methods=['POST'])
+@executor_placed
+def run_code_http():
+    data = request.json
+    code, error = submitted_program(data)
+    profile, profile_error = submitted_profile(data)
+    priority, priority_error = submitted_priority(data)
+    track_heap, heap_error = submitted_heap_tracking(data, profile)
+
+    if error or profile_error or priority_error or heap_error:
+        return jsonify({'error': error or profile_error or priority_error or heap_error}), 400
+
+    cpp_path, exe_path = write_source(code)
+    print(f"Compiling {cpp_path} to {exe_path} ({profile})")
+
+    try:
+        # Compile
+        user = request_user(data)
+        started = time.time()
+        with fair_share_slot(user, priority):
+            ok, stderr = compile_program(cpp_path, exe_path, profile, priority)
+        build = {'profile': profile, 'compileTime': round(time.time() - started, 3)}
+
+        if not ok:
+            return jsonify({
+                'message': 'Compilation failed',
+                'stderr': stderr,
+                **build
+            }), 400
+
+        # Batch mode: stdin supplied up front, run on pipes and answer in one reply
+        if 'stdinFile' in data:
+            stdin_path = input_file_path(data.get('stdinFile'))
+            if not stdin_path:
+                remove_files(cpp_path, exe_path)
+                return jsonify({'error': 'Input file not found'}), 404
+            try:
+                result = replayable_run_batch(exe_path, '', stdin_path=stdin_path, profile=profile, priority=priority,
+                                              track_heap=track_heap)
+            finally:
+                remove_files(cpp_path, exe_path)
+            if not result.get('replayed'):
+                record_usage(user, 'cpu', result['cpuTime'] or 0)
+            return jsonify({**result, **build})
+
+        if 'stdin' in data:
+            try:
+                result = replayable_run_batch(exe_path, data.get('stdin') or '', profile=profile, priority=priority,
+                                              track_heap=track_heap)
+            finally:
+                remove_files(cpp_path, exe_path)
+            if not result.get('replayed'):
+                record_usage(user, 'cpu', result['cpuTime'] or 0)
+            return jsonify({**result, **build})
+
+        return jsonify({'sessionId': start_session(cpp_path, exe_path, user, track_heap), **build})
+
+    except Exception as e:
+        remove_files(cpp_path, exe_path)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/run_code', methods=['POST'])
+@executor_placed
+def run_code():
+    """Older form of /run for single-file programs: compile and start a session"""
+    data = request.json
+    code = data.get('code', '')
+
+    if not code:
+        return jsonify({'error': 'No code provided'}), 400
+
+    cpp_path, exe_path = write_source(code)
+    print(f"Compiling {cpp_path} to {exe_path}")
+
+    try:
+        user = request_user(data)
+        with fair_share_slot(user):
+            ok, stderr = compile_program(cpp_path, exe_path)
+
+        if not ok:
+            remove_files(cpp_path, exe_path)
+            return jsonify({
+                'message': 'Compilation failed',
+                'stderr': stderr
+            }), 400
+
+        return jsonify({'sessionId': start_session(cpp_path, exe_path, user)})
+
+    except Exception as e:
+        remove_files(cpp_path, exe_path)
+        return jsonify({'error': str(e)}), 500
+
+def compile_events(cpp_path, exe_path, priority='interactive', profile=DEFAULT_PROFILE):
+    """Run g++ and yield events for its diagnostics as they are emitted.
+
+    Returns (ok, stderr) once the compiler has finished.
+    """
+    if os.path.isdir(cpp_path):
+        return (yield from project_compile_events(cpp_path, exe_path, priority, profile))
+
+    started = time.time()
+    flags = BUILD_PROFILES[profile]
+
+    stderr, keys = lookup_build(cpp_path, flags, exe_path, priority)
+    if stderr is not None:
+        for line in stderr.splitlines(keepends=True):
+            yield {'diagnostic': line}
+        yield {'status': 'compiled', 'profile': profile, 'compileTime': round(time.time() - started, 3), 'cached': True}
+        return True, stderr
+
+    # Speculation stays off the shared workers
+    result = remote_compile(cpp_path, exe_path, flags) if priority != 'speculative' else None
+    if result is not None:
+        # Workers answer in one piece, so the diagnostics arrive together
+        ok, stderr = result
+        for line in stderr.splitlines(keepends=True):
+            yield {'diagnostic': line}
+        if ok:
+            cache_store(keys, exe_path, stderr)
+            yield {'status': 'compiled', 'profile': profile, 'compileTime': round(time.time() - started, 3)}
+        return result
+
+    stderr_lines = []
+
+    with counting_compile(priority):
+        proc = subprocess.Popen(
+            compiler_command(['g++', cpp_path, '-o', exe_path, '-fdiagnostics-color=never'] + flags, priority),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        watchdog = eventlet.spawn_after(COMPILE_TIMEOUT, proc.kill)
+        try:
+            for line in iter(proc.stderr.readline, b''):
+                text = line.decode(errors='replace')
+                stderr_lines.append(text)
+                yield {'diagnostic': text}
+            proc.wait()
+        finally:
+            watchdog.cancel()
+            if proc.poll() is None:
+                # The client went away mid-compile, or a speculative build was cancelled
+                proc.kill()
+                proc.wait()
+            proc.stderr.close()
+
+    stderr = ''.join(stderr_lines)
+    if proc.returncode != 0:
+        if proc.returncode == -signal.SIGKILL:
+            stderr += f'Compilation timed out after {COMPILE_TIMEOUT} seconds\n'
+        return False, stderr
+
+    cache_store(keys, exe_path, stderr)
+    yield {'status': 'compiled', 'profile': profile, 'compileTime': round(time.time() - started, 3)}
+    return True, stderr
+
+# Speculative builds: the editor posts its buffer when the student pauses typing and
+# we compile it into the cache in the speculative class, so Run usually finds it built.
+# One build runs at a time per process, only while no real compile is in flight,
+# and a real compile starting here preempts it.
+SPECULATIVE_QUEUE_LIMIT = 64
+SPECULATIVE_IDLE_POLL = 0.1  # seconds between checks for real compiles to finish
+
+speculative_queue = collections.OrderedDict()  # user -> newest (code, profile) awaiting a build
+speculative_running = {'user': None, 'build': None, 'thread': None}
+speculative_worker_thread = None
+
+def speculative_build(code, profile):
+    cpp_path, exe_path = write_source(code)
+    try:
+        final_value(compile_events(cpp_path, exe_path, priority='speculative', profile=profile))
+        compile_cache_stats['speculativeBuilds'] += 1
+    finally:
+        remove_files(cpp_path, exe_path)
+
+def cancel_speculative_build():
+    thread = speculative_running['thread']
+    if thread is not None:
+        speculative_running['thread'] = None
+        compile_cache_stats['speculativeCancelled'] += 1
+        thread.kill()
+
+def preempt_speculative_build():
+    """Make way for a real compile; the preempted buffer goes back to the front of the queue"""
+    user, build = speculative_running['user'], speculative_running['build']
+    if speculative_running['thread'] is None:
+        return
+    if user not in speculative_queue:
+        speculative_queue[user] = build
+        speculative_queue.move_to_end(user, last=False)
+    cancel_speculative_build()
+
+def run_speculative_builds():
+    global speculative_worker_thread
+    try:
+        while speculative_queue:
+            while executor_stats['compiles']:
+                eventlet.sleep(SPECULATIVE_IDLE_POLL)
+            user, build = speculative_queue.popitem(last=False)
+            thread = eventlet.spawn(speculative_build, *build)
+            speculative_running.update(user=user, build=build, thread=thread)
+            try:
+                thread.wait()
+            except greenlet.GreenletExit:
+                pass  # Superseded or preempted
+            except CompileAdmissionError:
+                pass  # No memory to spare for cache warming, the real Run compiles it
+            except Exception as e:
+                print(f"Speculative build for {user} failed: {e}")
+            finally:
+                speculative_running.update(user=None, build=None, thread=None)
+    finally:
+        speculative_worker_thread = None
+
+def queue_speculative_build(user, code, profile):
+    """Queue a user's buffer for a speculative build, superseding their older ones"""
+    global speculative_worker_thread
+    if speculative_running['user'] == user:
+        if speculative_running['build'] == (code, profile):
+            return
+        cancel_speculative_build()
+    speculative_queue.pop(user, None)
+    speculative_queue[user] = (code, profile)
+    while len(speculative_queue) > SPECULATIVE_QUEUE_LIMIT:
+        speculative_queue.popitem(last=False)
+    if speculative_worker_thread is None:
+        speculative_worker_thread = eventlet.spawn(run_speculative_builds)
+
+def user_executor(user):
+    """Executor a user's speculative builds and lint checks stick to, so newer buffers
+    supersede older ones"""
+    try:
+        names = sorted(os.listdir(EXECUTOR_SOCKET_DIR))
+    except FileNotFoundError:
+        return None
+    if not names:
+        return None
+    index = int(hashlib.sha256(user.encode()).hexdigest(), 16) % len(names)
+    return os.path.join(EXECUTOR_SOCKET_DIR, names[index])
+
+def user_placed(view):
+    """On the front process, hand the request to the executor its user sticks to"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if ROLE != 'front' or forwarded_request():
+            return view(*args, **kwargs)
+
+        address = user_executor(request_user(request.json or {}))
+        response = forward_to_worker(address) if address else None
+        if response is None:
+            return jsonify({'error': 'No executor available, please try again'}), 503
+        return response
+    return wrapper
+
+@app.route('/compile/speculative', methods=['POST'])
+@user_placed
+def speculative_compile():
+    data = request.json
+    code, error = submitted_program(data)
+    profile, profile_error = submitted_profile(data)
+    if error or profile_error:
+        return jsonify({'error': error or profile_error}), 400
+
+    queue_speculative_build(request_user(data), code, profile)
+    return jsonify({'status': 'queued'}), 202
+
+# Lint: g++ -fsyntax-only with JSON diagnostics, for live markers in the editor.
+# Results are cached per content; a newer check from the same user cancels theirs
+# still in flight.
+LINT_FLAGS = ['-Wall', '-Wextra']
+LINT_TIMEOUT = 5  # seconds
+LINT_CACHE_SIZE = 1000
+
+lint_cache = collections.OrderedDict()  # content key -> diagnostics
+lint_checks = {}  # user -> greenthread running their latest check
+
+def diagnostic_location(diagnostic):
+    """file/line/column of a diagnostic's primary location, plus its end when g++ gives one"""
+    if not diagnostic.get('locations'):
+        return {'file': None, 'line': None, 'column': None}
+    location = diagnostic['locations'][0]
+    caret = location['caret']
+    found = {'file': caret.get('file'), 'line': caret.get('line'), 'column': caret.get('column')}
+    if 'finish' in location:
+        found['endLine'] = location['finish'].get('line')
+        found['endColumn'] = location['finish'].get('column')
+    return found
+
+def parse_diagnostics(output):
+    """Flatten g++'s -fdiagnostics-format=json output into editor-friendly records"""
+    diagnostics = []
+    for diagnostic in json.loads(output or '[]'):
+        diagnostics.append({
+            **diagnostic_location(diagnostic),
+            'severity': diagnostic['kind'],
+            'message': diagnostic['message'],
+            'option': diagnostic.get('option'),
+            'notes': [
+                {**diagnostic_location(child), 'message': child['message']}
+                for child in diagnostic.get('children', [])
+            ]
+        })
+    return diagnostics
+
+def syntax_check(code):
+    """Diagnostics for code (source or project), without codegen or linking. Checks
+    run in the speculative class: a keystroke is no reason to preempt a speculative
+    build or to hold a compile slot, and they don't count as compile usage."""
+    if isinstance(code, dict):
+        files = code
+    else:
+        files = {'main.cpp': code}
+    key = hashlib.sha256(json.dumps(['lint', compiler_identity(), LANGUAGE_FLAGS + LINT_FLAGS, files]).encode()).hexdigest()
+    if key in lint_cache:
+        lint_cache.move_to_end(key)
+        compile_cache_stats['lintHits'] += 1
+        return lint_cache[key]
+
+    compile_cache_stats['lintChecks'] += 1
+    work = tempfile.mkdtemp(suffix='.lint')
+    try:
+        for name, source in files.items():
+            with open(os.path.join(work, name), 'w') as f:
+                f.write(source)
+        units = sorted(name for name in files if name.endswith(SOURCE_EXTENSIONS))
+        with counting_compile('speculative'):
+            # Relative names keep the temp dir out of the diagnostics
+            proc = subprocess.run(
+                compiler_command(['g++', '-fsyntax-only', '-fdiagnostics-format=json'] + LANGUAGE_FLAGS + LINT_FLAGS + units,
+                                 'speculative'),
+                capture_output=True,
+                text=True,
+                timeout=LINT_TIMEOUT,
+                cwd=work
+            )
+        diagnostics = parse_diagnostics(proc.stderr)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    lint_cache[key] = diagnostics
+    if len(lint_cache) > LINT_CACHE_SIZE:
+        lint_cache.popitem(last=False)
+    return diagnostics
+
+@app.route('/lint', methods=['POST'])
+@user_placed
+def lint_code():
+    data = request.json
+    code, error = submitted_program(data)
+    if error:
+        return jsonify({'error': error}), 400
+    user = request_user(data)
+
+    previous = lint_checks.get(user)
+    if previous is not None:
+        compile_cache_stats['lintSuperseded'] += 1
+        previous.kill()
+
+    check = eventlet.spawn(syntax_check, code)
+    lint_checks[user] = check
+    try:
+        diagnostics = check.wait()
+    except greenlet.GreenletExit:
+        return jsonify({'status': 'superseded'}), 409
+    except subprocess.TimeoutExpired:
+        return jsonify({'error': f'Check timed out after {LINT_TIMEOUT} seconds'}), 504
+    except CompileAdmissionError as e:
+        return jsonify({'error': str(e)}), 503
+    except ValueError:
+        return jsonify({'error': 'Unreadable compiler diagnostics'}), 500
+    finally:
+        if lint_checks.get(user) is check:
+            del lint_checks[user]
+
+    return jsonify({'diagnostics': diagnostics})
+
+def sse_frames(events):
+    """Format a generator of event dicts as SSE frames, passing its return value through"""
+    while True:
+        try:
+            event = next(events)
+        except StopIteration as stop:
+            return stop.value
+        yield f"data: {json.dumps(event)}\n\n"
+
+def local_run_events(code, profile=DEFAULT_PROFILE, user='', track_heap=False):
+    """Compile code and start a session here, yielding progress events.
+
+    Returns the new session id, or None if the code didn't compile.
+    """
+    cpp_path, exe_path = write_source(code)
+    print(f"Compiling {cpp_path} to {exe_path} ({profile})")
+
+    session_id = None
+    try:
+        yield {'status': 'compiling', 'profile': profile}
+
+        with fair_share_slot(user):
+            ok, stderr = yield from compile_events(cpp_path, exe_path, profile=profile)
+        if not ok:
+            yield {'status': 'compile_error', 'message': 'Compilation failed', 'stderr': stderr}
+            return None
+
+        session_id = start_session(cpp_path, exe_path, user, track_heap)
+        yield {'sessionId': session_id}
+    except GeneratorExit:
+        # The client went away before it learned the session id
+        if session_id:
+            cleanup_session(session_id)
+        raise
+    except Exception as e:
+        yield {'error': str(e)}
+    finally:
+        if session_id is None:
+            remove_files(cpp_path, exe_path)
+    return session_id
+
+def remote_run_events(code, profile=DEFAULT_PROFILE, user='', track_heap=False):
+    """Front side of local_run_events: compile and start the session on an executor"""
+    address = pick_executor()
+    if not address:
+        yield {'error': 'No executor available, please try again'}
+        return None
+
+    session_id = None
+    conn, upstream = local_request(
+        address, 'POST', '/run/stream',
+        body=json.dumps({
+            'files' if isinstance(code, dict) else 'code': code,
+            'profile': profile,
+            'userSessionId': user,
+            'trackHeap': track_heap,
+            'attach': False
+        }),
+        headers={'Content-Type': 'application/json'},
+        timeout=COMPILE_TIMEOUT + 5
+    )
+    try:
+        for event in read_sse_events(upstream):
+            session_id = event.get('sessionId', session_id)
+            yield event
+    finally:
+        conn.close()
+    return session_id
+
+def run_events(code, profile=DEFAULT_PROFILE, user='', track_heap=False):
+    """Compile and start a session wherever this process's role puts it"""
+    if ROLE == 'front':
+        return (yield from remote_run_events(code, profile, user, track_heap))
+    return (yield from local_run_events(code, profile, user, track_heap))
+
+@app.route('/run/stream', methods=['POST'])
+@executor_placed
+def run_code_stream():
+    """Compile and run in one streamed response: diagnostics, sessionId, then output"""
+    data = request.json
+    code, error = submitted_program(data)
+    profile, profile_error = submitted_profile(data)
+    track_heap, heap_error = submitted_heap_tracking(data, profile)
+    # attach=False stops after the sessionId, for callers that read output elsewhere
+    attach = data.get('attach', True)
+
+    if error or profile_error or heap_error:
+        return jsonify({'error': error or profile_error or heap_error}), 400
+    user = request_user(data)  # The response streams after the request context is gone
+
+    def generate():
+        session_id = yield from sse_frames(local_run_events(code, profile, user, track_heap))
+        if session_id and attach:
+            yield from session_output(session_id)
+
+    return Response(generate(), mimetype='text/event-stream')
+
+# Autograding: a submission is compiled once, then run against every test of an
+# exercise in parallel, each test under its own limits, and the verdicts stream
+# back as the tests finish. An exercise is a stored suite of inputs with expected
+# outputs, given up front or produced once from a reference solution and kept.
+EXERCISE_DIR = '/tmp/cpp_exercises'
+EXERCISE_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+GRADE_JOBS = os.cpu_count() or 2  # tests run at once per submission
+GRADE_MAX_TESTS = 200
+GRADE_TIME_LIMIT = 2  # default seconds of CPU time per test
+GRADE_MAX_TIME_LIMIT = 10
+GRADE_MEMORY_LIMIT_MB = 256  # default address space per test
+GRADE_MAX_MEMORY_LIMIT_MB = 1024
+GRADE_STDERR_EXCERPT = 1000  # bytes of a failing test's stderr sent back
+MEMORY_FAILURE = re.compile(r'std::bad_alloc|memory exhausted|out of memory|hard rss limit exhausted|allocation-size-too-big')
+
+exercise_locks = collections.defaultdict(eventlet.semaphore.Semaphore)
+
+class GradingError(Exception):
+    pass
+
+def exercise_path(exercise_id, *names):
+    return os.path.join(EXERCISE_DIR, exercise_id, *names)
+
+def submitted_suite(data):
+    """The test suite an exercise or grading request carries: returns (suite, error message)"""
+    tests = data.get('tests')
+    if not isinstance(tests, list) or not tests:
+        return None, 'No tests provided'
+    if len(tests) > GRADE_MAX_TESTS:
+        return None, f'Too many tests, the limit is {GRADE_MAX_TESTS}'
+
+    solution = None
+    if data.get('solution') is not None:
+        solution = {'files' if isinstance(data['solution'], dict) else 'code': data['solution']}
+        solution_code, error = submitted_program(solution)
+        if error:
+            return None, f'Solution: {error}'
+        profile, error = submitted_profile({'profile': data.get('solutionProfile')})
+        if error:
+            return None, f'Solution: {error}'
+        solution = {'code': solution_code, 'profile': profile}
+
+    compare = data.get('compare') or DEFAULT_COMPARE_MODE
+    if compare not in COMPARE_MODES:
+        return None, f"Unknown compare mode: {compare}, choose one of {', '.join(COMPARE_MODES)}"
+    try:
+        tolerance = float(data.get('tolerance', DEFAULT_TOLERANCE))
+    except (TypeError, ValueError):
+        return None, 'Invalid tolerance'
+
+    suite = {'tests': [], 'solution': solution, 'compare': compare, 'tolerance': tolerance}
+    for index, test in enumerate(tests):
+        if not isinstance(test, dict) or not isinstance(test.get('input', ''), str):
+            return None, f'Test {index}: input must be a string'
+        if 'expected' in test and not isinstance(test['expected'], str):
+            return None, f'Test {index}: expected must be a string'
+        if 'expected' not in test and solution is None:
+            return None, f'Test {index}: no expected output and no solution to produce it'
+        try:
+            time_limit = float(test.get('timeLimit', data.get('timeLimit', GRADE_TIME_LIMIT)))
+            memory_limit = int(test.get('memoryLimitMb', data.get('memoryLimitMb', GRADE_MEMORY_LIMIT_MB)))
+        except (TypeError, ValueError):
+            return None, f'Test {index}: invalid limits'
+        if not 0 < time_limit <= GRADE_MAX_TIME_LIMIT or not 0 < memory_limit <= GRADE_MAX_MEMORY_LIMIT_MB:
+            return None, (f'Test {index}: limits must be at most {GRADE_MAX_TIME_LIMIT} s '
+                          f'and {GRADE_MAX_MEMORY_LIMIT_MB} MB')
+        suite['tests'].append({
+            'name': str(test.get('name') or index + 1),
+            'input': test.get('input', ''),
+            'expected': test.get('expected'),
+            'timeLimit': time_limit,
+            'memoryLimitMb': memory_limit
+        })
+    return suite, None
+
+def store_exercise(exercise_id, suite):
+    """Write a suite to the exercise directory, replacing any previous version whole"""
+    os.makedirs(EXERCISE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=EXERCISE_DIR, prefix=f'.{exercise_id}.')
+    tests = []
+    for index, test in enumerate(suite['tests']):
+        with open(os.path.join(staging, f'{index}.in'), 'w') as f:
+            f.write(test['input'])
+        if test['expected'] is not None:
+            with open(os.path.join(staging, f'{index}.out'), 'w') as f:
+                f.write(test['expected'])
+        tests.append({key: test[key] for key in ('name', 'timeLimit', 'memoryLimitMb')})
+    with open(os.path.join(staging, 'suite.json'), 'w') as f:
+        json.dump({**suite, 'tests': tests}, f)
+
+    with exercise_locks[exercise_id]:
+        retired = None
+        if os.path.exists(exercise_path(exercise_id)):
+            retired = f'{staging}.old'
+            os.rename(exercise_path(exercise_id), retired)
+        os.rename(staging, exercise_path(exercise_id))
+    if retired:
+        shutil.rmtree(retired, ignore_errors=True)
+
+def load_exercise(exercise_id):
+    """An exercise's suite.json, or None if there is no such exercise"""
+    if not EXERCISE_ID.fullmatch(exercise_id or ''):
+        return None
+    try:
+        with open(exercise_path(exercise_id, 'suite.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def missing_expected(exercise_id, suite):
+    return [index for index in range(len(suite['tests']))
+            if not os.path.exists(exercise_path(exercise_id, f'{index}.out'))]
+
+def ensure_expected_outputs(exercise_id, suite, priority):
+    """Produce the expected outputs an exercise lacks by running its reference
+    solution, once: later gradings read the files it leaves behind"""
+    if not missing_expected(exercise_id, suite):
+        return
+    with exercise_locks[exercise_id]:
+        missing = missing_expected(exercise_id, suite)
+        if not missing:
+            return  # Produced while we waited
+
+        solution = suite['solution']
+        cpp_path, exe_path = write_source(solution['code'])
+        try:
+            ok, stderr = compile_program(cpp_path, exe_path, solution['profile'], priority)
+            if not ok:
+                raise GradingError(f'The reference solution does not compile:\n{stderr}')
+
+            def produce(index):
+                test = suite['tests'][index]
+                target = exercise_path(exercise_id, f'{index}.out')
+                with open(f'{target}.tmp', 'wb') as f:
+                    result = run_batch(
+                        exe_path, '', stdin_path=exercise_path(exercise_id, f'{index}.in'),
+                        profile=solution['profile'], priority=priority, stdout_consumer=f.write, **test_limits(test)
+                    )
+                if result['timedOut'] or result['exitCode'] != 0:
+                    os.remove(f'{target}.tmp')
+                    raise GradingError(f'The reference solution failed on test {test["name"]}')
+                os.replace(f'{target}.tmp', target)
+
+            for _ in eventlet.GreenPool(GRADE_JOBS).imap(produce, missing):
+                pass
+        finally:
+            remove_files(cpp_path, exe_path)
+
+def test_limits(test):
+    """run_batch limits for a test: its CPU time, a wall clock with room for I/O, its memory"""
+    return {
+        'time_limit': max(test['timeLimit'] * 2, test['timeLimit'] + 1),
+        'cpu_limit': test['timeLimit'],
+        'memory_limit': test['memoryLimitMb'] * 1024 * 1024
+    }
+
+COMPARE_MODES = ('exact', 'whitespace', 'token', 'float')
+DEFAULT_COMPARE_MODE = 'whitespace'
+DEFAULT_TOLERANCE = 1e-6  # absolute, or relative to the expected value when that is larger
+COMPARE_CONTEXT = 40  # bytes of each side shown around a mismatch
+FLOAT_TOKEN_SLACK = 64  # bytes a number may run longer than the expected one
+TOKEN = re.compile(rb'\S+')
+NON_BLANK = re.compile(rb'\S')
+
+class OutputComparator:
+    """Check a program's stdout against an expected output file as it arrives.
+
+    feed() takes each chunk of output and returns False at the first mismatch, so
+    the program can be stopped right there; finish() checks that nothing expected
+    is missing once the output ends. The expected file is memory-mapped and never
+    read whole. Modes:
+
+        exact       byte for byte
+        whitespace  line by line, ignoring trailing whitespace and trailing blank lines
+        token       whitespace-separated tokens, however they are spaced
+        float       tokens, numbers equal within the tolerance
+    """
+
+    def __init__(self, expected_path, mode=DEFAULT_COMPARE_MODE, tolerance=DEFAULT_TOLERANCE):
+        self.mode = mode
+        self.tolerance = tolerance
+        with open(expected_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.expected = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.position = 0  # offset into the expected output
+        self.line = 1  # line of the expected output at position
+        self.pending = b''  # output not judged yet: a partial line or token
+        self.blank_lines = 0  # blank output lines that may turn out to be trailing
+        self.recent = b''  # last bytes of output, for context
+        self.mismatch = None
+
+    def close(self):
+        if isinstance(self.expected, mmap.mmap):
+            self.expected.close()
+
+    def feed(self, data):
+        if self.mismatch:
+            return False
+        chunk = data
+        if self.mode == 'exact':
+            self.compare_bytes(data)
+        else:
+            if self.pending or self.blank_lines:
+                # Settle the line or token in progress first
+                first = data.find(b'\n') + 1 or len(data)
+                self.compare_text(data[:first])
+                data = data[first:]
+                if self.mode != 'whitespace' and not self.pending:
+                    self.skip_expected_whitespace()
+            # Output identical to the expected bytes up to its last newline needs no splitting
+            cut = data.rfind(b'\n') + 1
+            if (cut and not self.mismatch and not self.pending and not self.blank_lines
+                    and self.expected[self.position:self.position + cut] == data[:cut]):
+                self.position += cut
+                self.line += data.count(b'\n', 0, cut)
+                data = data[cut:]
+            if data and not self.mismatch:
+                self.compare_text(data)
+        self.recent = (self.recent + chunk)[-COMPARE_CONTEXT:]
+        return self.mismatch is None
+
+    def compare_text(self, data):
+        if self.mode == 'whitespace':
+            self.compare_lines(data)
+        else:
+            self.compare_tokens(data)
+
+    def finish(self):
+        """The mismatch, if any, once the program's output has ended"""
+        if self.mismatch:
+            return self.mismatch
+        if self.mode == 'exact':
+            if self.position < len(self.expected):
+                self.report(b'')
+        elif self.mode == 'whitespace':
+            if self.pending.rstrip():
+                self.compare_line(self.pending)
+            if not self.mismatch:
+                # Only blank lines may be left of the expected output
+                self.skip_blank_expected()
+                if self.position < len(self.expected):
+                    self.report(b'')
+        else:
+            if self.pending:
+                self.compare_token(self.pending)
+            if not self.mismatch and TOKEN.search(self.expected, self.position):
+                self.report(b'')
+        return self.mismatch
+
+    def report(self, actual, before=0):
+        """Record the first mismatch at the current expected position: the offending
+        output, and as much of the expected output, each with `before` bytes leading up to it"""
+        start = max(self.position - before, 0)
+        leading = self.recent[max(len(self.recent) - before, 0):] if before else b''
+        self.mismatch = {
+            'mode': self.mode,
+            'offset': self.position,
+            'line': self.line,
+            'expected': bytes(self.expected[start:self.position + COMPARE_CONTEXT - before]).decode(errors='replace'),
+            'actual': (leading + actual)[:COMPARE_CONTEXT].decode(errors='replace')
+        }
+
+    def compare_bytes(self, data):
+        expected = self.expected[self.position:self.position + len(data)]
+        if expected == data:
+            self.position += len(data)
+            self.line += data.count(b'\n')
+            return
+        same = next((i for i, (a, b) in enumerate(zip(data, expected)) if a != b), len(expected))
+        self.recent = (self.recent + data[:same])[-COMPARE_CONTEXT:]
+        self.position += same
+        self.line += data[:same].count(b'\n')
+        self.report(data[same:], before=COMPARE_CONTEXT // 2)
+
+    def next_expected_line(self):
+        """The expected line at position (without its newline) and where the next one starts"""
+        end = self.expected.find(b'\n', self.position)
+        if end < 0:
+            end = len(self.expected)
+        return self.expected[self.position:end], min(end + 1, len(self.expected))
+
+    def compare_line(self, line):
+        line = line.rstrip()
+        if not line:
+            self.blank_lines += 1
+            return
+        # Blank lines before this one weren't trailing after all
+        for _ in range(self.blank_lines):
+            if not self.take_expected_line(b''):
+                return
+        self.blank_lines = 0
+        self.take_expected_line(line)
+
+    def take_expected_line(self, line):
+        expected, following = self.next_expected_line()
+        if self.position >= len(self.expected) or expected.rstrip() != line:
+            self.report(line)
+            return False
+        self.position = following
+        self.line += 1
+        return True
+
+    def skip_blank_expected(self):
+        while self.position < len(self.expected):
+            expected, following = self.next_expected_line()
+            if expected.strip():
+                return
+            self.position = following
+            self.line += 1
+
+    def compare_lines(self, data):
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.compare_line(line)
+            if self.mismatch:
+                return
+
+    def compare_tokens(self, data):
+        data = self.pending + data
+        self.pending = b''
+        for match in TOKEN.finditer(data):
+            if match.end() == len(data):
+                # May continue in the next chunk
+                self.pending = match.group()
+                self.check_partial_token()
+                return
+            self.compare_token(match.group())
+            if self.mismatch:
+                return
+
+    def check_partial_token(self):
+        """Catch a runaway token before it is complete, so output without any
+        whitespace can't grow without bound"""
+        match = TOKEN.search(self.expected, self.position)
+        expected = match.group() if match else b''
+        if self.mode == 'token' and not expected.startswith(self.pending):
+            self.compare_token(self.pending)
+        elif self.mode == 'float' and len(self.pending) > len(expected) + FLOAT_TOKEN_SLACK:
+            self.compare_token(self.pending)
+
+    def skip_expected_whitespace(self):
+        """Line the expected position up with output that has moved past a token's
+        trailing whitespace"""
+        match = NON_BLANK.search(self.expected, self.position)
+        following = match.start() if match else len(self.expected)
+        self.line += self.expected[self.position:following].count(b'\n')
+        self.position = following
+
+    def compare_token(self, token):
+        match = TOKEN.search(self.expected, self.position)
+        if match:
+            self.line += self.expected[self.position:match.start()].count(b'\n')
+            self.position = match.start()
+        if not match or not self.tokens_equal(token, match.group()):
+            self.report(token)
+            return
+        self.position = match.end()
+
+    def tokens_equal(self, actual, expected):
+        if actual == expected:
+            return True
+        if self.mode != 'float':
+            return False
+        try:
+            a, b = float(actual), float(expected)
+        except ValueError:
+            return False
+        if math.isnan(a) or math.isnan(b):
+            return math.isnan(a) and math.isnan(b)
+        return abs(a - b) <= self.tolerance * max(1.0, abs(b))
+
+def test_verdict(test, result, comparator):
+    """AC, WA, TLE, MLE or RE for one finished test, with what the student needs to see.
+    Output that went wrong before the program finished is a WA whatever came after."""
+    verdict = {'verdict': 'AC', 'time': result['cpuTime'], 'memoryKb': result['peakMemoryKb']}
+    failed = result['exitCode'] != 0
+    if result['stopped']:
+        verdict.update(verdict='WA', mismatch=comparator.mismatch)
+    elif result['timedOut'] or result['signal'] == signal.SIGXCPU or (result['cpuTime'] or 0) > test['timeLimit']:
+        verdict['verdict'] = 'TLE'
+    elif failed and (MEMORY_FAILURE.search(result['stderr']) or
+                     (result['peakMemoryKb'] or 0) >= test['memoryLimitMb'] * 1024 * 0.95):
+        verdict['verdict'] = 'MLE'
+    elif failed:
+        verdict.update(verdict='RE', exitCode=result['exitCode'], signal=result['signal'])
+    elif comparator.finish():
+        verdict.update(verdict='WA', mismatch=comparator.mismatch)
+    if verdict['verdict'] != 'AC' and result['stderr']:
+        verdict['stderr'] = result['stderr'][:GRADE_STDERR_EXCERPT]
+    return verdict
+
+def grade_events(code, exercise_id, profile=DEFAULT_PROFILE, priority='interactive', user=''):
+    """Compile a submission and run it against an exercise, yielding progress and
+    one event per test as it finishes"""
+    suite = load_exercise(exercise_id)
+    if suite is None:
+        yield {'error': 'Exercise not found'}
+        return
+    cpp_path, exe_path = write_source(code)
+    pool = eventlet.GreenPool(GRADE_JOBS)
+    try:
+        yield {'status': 'compiling', 'profile': profile}
+        with fair_share_slot(user, priority):
+            ok, stderr = yield from compile_events(cpp_path, exe_path, priority, profile)
+        if not ok:
+            yield {'status': 'compile_error', 'message': 'Compilation failed', 'stderr': stderr}
+            return
+
+        ensure_expected_outputs(exercise_id, suite, priority)
+
+        tests = suite['tests']
+        yield {'status': 'testing', 'tests': len(tests)}
+        finished = eventlet.queue.LightQueue()
+
+        def run_test(index):
+            test = tests[index]
+            comparator = None
+            try:
+                comparator = OutputComparator(
+                    exercise_path(exercise_id, f'{index}.out'), suite['compare'], suite['tolerance']
+                )
+                result = run_batch(
+                    exe_path, '', stdin_path=exercise_path(exercise_id, f'{index}.in'),
+                    profile=profile, priority=priority, stdout_consumer=comparator.feed, **test_limits(test)
+                )
+                record_usage(user, 'cpu', result['cpuTime'] or 0)
+                verdict = test_verdict(test, result, comparator)
+            except Exception as e:
+                verdict = {'error': str(e)}
+            finally:
+                if comparator:
+                    comparator.close()
+            finished.put({'test': index, 'name': test['name'], **verdict})
+
+        for index in range(len(tests)):
+            pool.spawn_n(run_test, index)
+
+        counts = collections.Counter()
+        for _ in tests:
+            event = finished.get()
+            counts[event.get('verdict', 'error')] += 1
+            yield event
+        yield {'status': 'graded', 'passed': counts['AC'], 'total': len(tests), 'verdicts': dict(counts)}
+    except Exception as e:
+        yield {'error': str(e)}
+    finally:
+        # The client may leave mid-run: stop the tests still going
+        for thread in list(pool.coroutines_running):
+            thread.kill()
+        remove_files(cpp_path, exe_path)
+
+@app.route('/exercises/<exercise_id>', methods=['PUT'])
+def put_exercise(exercise_id):
+    """Store an exercise's tests for /grade; expected outputs come with the tests or
+    from a reference solution run on the first grading"""
+    if not EXERCISE_ID.fullmatch(exercise_id):
+        return jsonify({'error': 'Invalid exercise id'}), 400
+    suite, error = submitted_suite(request.json or {})
+    if error:
+        return jsonify({'error': error}), 400
+    store_exercise(exercise_id, suite)
+    return jsonify({'exercise': exercise_id, 'tests': len(suite['tests'])})
+
+@app.route('/exercises/<exercise_id>', methods=['GET'])
+def get_exercise(exercise_id):
+    suite = load_exercise(exercise_id)
+    if suite is None:
+        return jsonify({'error': 'Exercise not found'}), 404
+    return jsonify({
+        'exercise': exercise_id,
+        'tests': suite['tests'],
+        'expectedReady': not missing_expected(exercise_id, suite)
+    })
+
+def requested_exercise(data):
+    """The exercise a grading request names, or stores from its inline tests:
+    returns (exercise id, error message, HTTP status)"""
+    exercise_id = data.get('exercise')
+    if exercise_id is None:
+        # Inline tests become an exercise named after their content, so regrading
+        # with the same suite reuses its expected outputs
+        suite, error = submitted_suite(data)
+        if error:
+            return None, error, 400
+        exercise_id = 'inline-' + hashlib.sha256(json.dumps(suite, sort_keys=True).encode()).hexdigest()[:32]
+        if load_exercise(exercise_id) is None:
+            store_exercise(exercise_id, suite)
+    elif load_exercise(exercise_id) is None:
+        return None, 'Exercise not found', 404
+    return exercise_id, None, None
+
+@app.route('/grade', methods=['POST'])
+@executor_placed
+def grade_submission():
+    """Compile once and stream a verdict per test (Server-Sent Events)"""
+    data = request.json
+    code, error = submitted_program(data)
+    profile, profile_error = submitted_profile(data)
+    priority, priority_error = submitted_priority(data)
+    if error or profile_error or priority_error:
+        return jsonify({'error': error or profile_error or priority_error}), 400
+
+    exercise_id, exercise_error, status = requested_exercise(data)
+    if exercise_error:
+        return jsonify({'error': exercise_error}), status
+
+    events = grade_events(code, exercise_id, profile, priority, request_user(data))
+    return Response(sse_frames(events), mimetype='text/event-stream')
+
+# Bulk grading: a teacher submits a whole class against one exercise as a job.
+# Identical sources are graded once, submissions run at batch priority a few at a
+# time, and progress lives in SQLite: a job whose process dies is picked up by
+# another (or the restarted) process and carries on with what is left.
+GRADE_JOB_DB = os.environ.get('GRADE_JOB_DB', '/tmp/cpp_grade_jobs.db')
+GRADE_JOB_MAX_SUBMISSIONS = 1000
+GRADE_JOB_CONCURRENCY = max((os.cpu_count() or 2) // 2, 1)  # submissions graded at once per job
+GRADE_JOB_HEARTBEAT = 10  # seconds between a running job's liveness updates
+GRADE_JOB_STALE = 60  # seconds without one before another process takes the job over
+VERDICTS = ('AC', 'WA', 'TLE', 'MLE', 'RE')
+
+class GradeJobStore:
+    """Jobs, their submissions and one result per distinct source, in SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS grade_jobs ('
+                'job_id TEXT PRIMARY KEY, exercise TEXT, profile TEXT, status TEXT, '
+                'created_at REAL, finished_at REAL, owner TEXT, heartbeat REAL)'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS grade_submissions ('
+                'job_id TEXT, student TEXT, source_hash TEXT, position INTEGER, '
+                'PRIMARY KEY (job_id, student))'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS grade_sources ('
+                'job_id TEXT, source_hash TEXT, program TEXT, status TEXT, result TEXT, '
+                'PRIMARY KEY (job_id, source_hash))'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def create(self, job_id, exercise, profile, submissions, owner):
+        """Store a job with its (student, program) submissions, owned by the caller"""
+        with self._connect() as db:
+            db.execute('INSERT INTO grade_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (job_id, exercise, profile, 'running', time.time(), None, owner, time.time()))
+            for position, (student, program) in enumerate(submissions):
+                source_hash = hashlib.sha256(json.dumps(program, sort_keys=True).encode()).hexdigest()
+                db.execute('INSERT INTO grade_submissions VALUES (?, ?, ?, ?)', (job_id, student, source_hash, position))
+                db.execute('INSERT OR IGNORE INTO grade_sources VALUES (?, ?, ?, ?, ?)',
+                           (job_id, source_hash, json.dumps(program), 'pending', None))
+
+    def job(self, job_id):
+        with self._connect() as db:
+            row = db.execute('SELECT exercise, profile, status, created_at, finished_at FROM grade_jobs WHERE job_id = ?',
+                             (job_id,)).fetchone()
+        if row is None:
+            return None
+        exercise, profile, status, created_at, finished_at = row
+        return {'jobId': job_id, 'exercise': exercise, 'profile': profile, 'status': status,
+                'createdAt': created_at, 'finishedAt': finished_at}
+
+    def stale_jobs(self, stale_before):
+        with self._connect() as db:
+            rows = db.execute("SELECT job_id FROM grade_jobs WHERE status = 'running' AND heartbeat < ?",
+                              (stale_before,)).fetchall()
+        return [job_id for job_id, in rows]
+
+    def claim(self, job_id, owner, stale_before):
+        """Take over a job nobody has kept alive; True if this caller got it"""
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE grade_jobs SET owner = ?, heartbeat = ? WHERE job_id = ? AND status = 'running' AND heartbeat < ?",
+                (owner, time.time(), job_id, stale_before)
+            ).rowcount
+        return claimed == 1
+
+    def heartbeat(self, job_id, owner):
+        with self._connect() as db:
+            db.execute('UPDATE grade_jobs SET heartbeat = ? WHERE job_id = ? AND owner = ?', (time.time(), job_id, owner))
+
+    def pending_sources(self, job_id):
+        """(source hash, program) of every distinct source still to grade"""
+        with self._connect() as db:
+            rows = db.execute("SELECT source_hash, program FROM grade_sources WHERE job_id = ? AND status = 'pending'",
+                              (job_id,)).fetchall()
+        return [(source_hash, json.loads(program)) for source_hash, program in rows]
+
+    def record(self, job_id, source_hash, outcome):
+        with self._connect() as db:
+            db.execute('UPDATE grade_sources SET status = ?, result = ? WHERE job_id = ? AND source_hash = ?',
+                       (outcome['status'], json.dumps(outcome), job_id, source_hash))
+
+    def finish(self, job_id):
+        with self._connect() as db:
+            db.execute("UPDATE grade_jobs SET status = 'done', finished_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def progress(self, job_id):
+        with self._connect() as db:
+            submissions, unique = db.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT source_hash) FROM grade_submissions WHERE job_id = ?', (job_id,)
+            ).fetchone()
+            graded = db.execute(
+                "SELECT COUNT(*) FROM grade_submissions s JOIN grade_sources g USING (job_id, source_hash) "
+                "WHERE s.job_id = ? AND g.status != 'pending'", (job_id,)
+            ).fetchone()[0]
+        return {'submissions': submissions, 'unique': unique, 'graded': graded}
+
+    def results(self, job_id):
+        """One result per submission, in the order they were submitted"""
+        with self._connect() as db:
+            rows = db.execute(
+                'SELECT s.student, g.status, g.result FROM grade_submissions s JOIN grade_sources g USING (job_id, source_hash) '
+                'WHERE s.job_id = ? ORDER BY s.position', (job_id,)
+            ).fetchall()
+        return [{'student': student, 'status': status, **(json.loads(result) if result else {})}
+                for student, status, result in rows]
+
+grade_jobs = GradeJobStore(GRADE_JOB_DB)
+grade_job_watcher_pid = None
+
+def grade_job_owner():
+    return f'{NODE_ID}.{worker_id()}'
+
+def grade_source(job, program):
+    """Grade one distinct source of a job: its outcome, with a verdict per test"""
+    outcome = {'status': 'graded', 'passed': 0, 'total': 0, 'verdicts': {}, 'tests': []}
+    events = grade_events(program, job['exercise'], job['profile'], 'batch', f'grade-job:{job["jobId"]}')
+    for event in events:
+        if 'test' in event:
+            outcome['tests'].append(event)
+        elif event.get('status') == 'graded':
+            outcome.update(passed=event['passed'], total=event['total'], verdicts=event['verdicts'])
+        elif event.get('status') == 'compile_error':
+            outcome.update(status='compile_error', stderr=event['stderr'])
+        elif 'error' in event:
+            outcome.update(status='error', error=event['error'])
+    outcome['tests'].sort(key=lambda test: test['test'])
+    return outcome
+
+def run_grade_job(job_id):
+    """Grade whatever a job has left, keeping its claim alive while at it"""
+    owner = grade_job_owner()
+    job = grade_jobs.job(job_id)
+
+    def keep_alive():
+        while True:
+            eventlet.sleep(GRADE_JOB_HEARTBEAT)
+            grade_jobs.heartbeat(job_id, owner)
+
+    def grade(pending):
+        source_hash, program = pending
+        try:
+            outcome = grade_source(job, program)
+        except Exception as e:
+            outcome = {'status': 'error', 'error': str(e)}
+        grade_jobs.record(job_id, source_hash, outcome)
+
+    beat = eventlet.spawn(keep_alive)
+    try:
+        pool = eventlet.GreenPool(GRADE_JOB_CONCURRENCY)
+        for pending in grade_jobs.pending_sources(job_id):
+            pool.spawn_n(grade, pending)
+        pool.waitall()
+        grade_jobs.finish(job_id)
+    except Exception as e:
+        print(f"Grading job {job_id} stopped: {e}")
+    finally:
+        beat.kill()
+
+def watch_grade_jobs():
+    """Resume jobs whose process stopped updating them"""
+    while True:
+        try:
+            stale_before = time.time() - GRADE_JOB_STALE
+            for job_id in grade_jobs.stale_jobs(stale_before):
+                if grade_jobs.claim(job_id, grade_job_owner(), stale_before):
+                    print(f"Resuming grading job {job_id}")
+                    eventlet.spawn(run_grade_job, job_id)
+        except sqlite3.Error as e:
+            print(f"Grading job watcher: {e}")
+        eventlet.sleep(GRADE_JOB_HEARTBEAT)
+
+def start_grade_job_watcher():
+    """Watch for orphaned jobs from every process that compiles, once per process"""
+    global grade_job_watcher_pid
+    if ROLE == 'front' or grade_job_watcher_pid == worker_id():
+        return
+    grade_job_watcher_pid = worker_id()
+    eventlet.spawn(watch_grade_jobs)
+
+def submitted_submissions(data):
+    """(student, program) pairs a job request carries: returns (submissions, error message)"""
+    entries = data.get('submissions')
+    if not isinstance(entries, list) or not entries:
+        return None, 'No submissions provided'
+    if len(entries) > GRADE_JOB_MAX_SUBMISSIONS:
+        return None, f'Too many submissions, the limit is {GRADE_JOB_MAX_SUBMISSIONS}'
+    submissions, students = [], set()
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            return None, f'Submission {index}: expected an object'
+        student = str(entry.get('student') or index + 1)
+        if student in students:
+            return None, f'Duplicate student: {student}'
+        students.add(student)
+        program, error = submitted_program(entry)
+        if error:
+            return None, f'Submission {student}: {error}'
+        submissions.append((student, program))
+    return submissions, None
+
+@app.route('/grade/jobs', methods=['POST'])
+@executor_placed
+def create_grade_job():
+    """Grade a class's submissions in the background; answers with the job id"""
+    data = request.json
+    submissions, error = submitted_submissions(data)
+    profile, profile_error = submitted_profile(data)
+    if error or profile_error:
+        return jsonify({'error': error or profile_error}), 400
+    exercise_id, exercise_error, status = requested_exercise(data)
+    if exercise_error:
+        return jsonify({'error': exercise_error}), status
+
+    job_id = uuid.uuid4().hex
+    grade_jobs.create(job_id, exercise_id, profile, submissions, grade_job_owner())
+    eventlet.spawn(run_grade_job, job_id)
+    return jsonify({'jobId': job_id, **grade_jobs.progress(job_id)}), 202
+
+@app.route('/grade/jobs/<job_id>', methods=['GET'])
+def grade_job_status(job_id):
+    job = grade_jobs.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({**job, **grade_jobs.progress(job_id)})
+
+@app.route('/grade/jobs/<job_id>/results', methods=['GET'])
+def grade_job_results(job_id):
+    """Results so far, as JSON or (format=csv) one CSV row per student"""
+    job = grade_jobs.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    results = grade_jobs.results(job_id)
+    if request.args.get('format') != 'csv':
+        return jsonify({**job, 'results': results})
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['student', 'status', 'passed', 'total'] + list(VERDICTS) + ['error'])
+    for result in results:
+        verdicts = result.get('verdicts', {})
+        writer.writerow(
+            [result['student'], result['status'], result.get('passed', ''), result.get('total', '')]
+            + [verdicts.get(verdict, 0) for verdict in VERDICTS]
+            + [result.get('error') or result.get('stderr', '').split('\n')[0]]
+        )
+    return Response(out.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=grades-{job_id}.csv'})
+
+# Performance lab: the same program built under several profiles and timed side by
+# side. Builds come from the compile cache like any other, so comparing again is
+# only the runs. Runs are pinned to one core that no other lab uses meanwhile,
+# start with untimed warm-up runs, and go round-robin over the profiles so a change
+# in machine load hits them all alike.
+LAB_PROFILES = ['quick', 'optimized', 'aggressive']
+LAB_RUNS = 5  # default timed runs per profile
+LAB_MAX_RUNS = 20
+LAB_WARMUP = 1  # default untimed runs per profile
+LAB_MAX_WARMUP = 3
+# LAB_CPUS="2,3": cores lab runs are pinned to (default: every core this process may use)
+LAB_CPUS = [int(cpu) for cpu in os.environ.get('LAB_CPUS', '').split(',') if cpu.strip()] \
+    or sorted(os.sched_getaffinity(0))
+
+lab_cores = eventlet.queue.LightQueue()
+for cpu in LAB_CPUS:
+    lab_cores.put(cpu)
+
+@contextlib.contextmanager
+def lab_core():
+    """A core to pin lab runs to, waiting for one when every core is measuring"""
+    cpu = lab_cores.get()
+    try:
+        yield cpu
+    finally:
+        lab_cores.put(cpu)
+
+def submitted_lab(data):
+    """Profiles, timed runs and warm-up runs a lab request asks for: returns (lab, error message)"""
+    profiles = data.get('profiles') or LAB_PROFILES
+    if not isinstance(profiles, list) or len(set(profiles)) != len(profiles):
+        return None, 'profiles must be a list of distinct profile names'
+    unknown = [profile for profile in profiles if profile not in BUILD_PROFILES]
+    if unknown:
+        return None, f"Unknown profile: {unknown[0]}, choose one of {', '.join(BUILD_PROFILES)}"
+    try:
+        runs = int(data.get('runs', LAB_RUNS))
+        warmup = int(data.get('warmup', LAB_WARMUP))
+    except (TypeError, ValueError):
+        return None, 'runs and warmup must be integers'
+    if not 1 <= runs <= LAB_MAX_RUNS:
+        return None, f'runs must be between 1 and {LAB_MAX_RUNS}'
+    if not 0 <= warmup <= LAB_MAX_WARMUP:
+        return None, f'warmup must be between 0 and {LAB_MAX_WARMUP}'
+    return {'profiles': profiles, 'runs': runs, 'warmup': warmup}, None
+
+def timing_summary(values):
+    return {
+        'mean': round(statistics.fmean(values), 4),
+        'median': round(statistics.median(values), 4),
+        'stddev': round(statistics.stdev(values), 4) if len(values) > 1 else 0.0,
+        'min': round(min(values), 4)
+    }
+
+def lab_events(code, lab, stdin_data='', stdin_path=None, user=''):
+    """Build a program under each profile in parallel, then time the builds side by side.
+    Yields compile progress, one event per timed run, and the comparison."""
+    profiles = lab['profiles']
+    builds = {profile: write_source(code) for profile in profiles}
+    pool = eventlet.GreenPool(len(profiles))
+    try:
+        yield {'status': 'compiling', 'profiles': profiles}
+
+        def build(profile):
+            cpp_path, exe_path = builds[profile]
+            started = time.time()
+            with fair_share_slot(user):
+                ok, stderr = compile_program(cpp_path, exe_path, profile)
+            return profile, ok, stderr, round(time.time() - started, 3)
+
+        failed = False
+        for profile, ok, stderr, compile_time in pool.imap(build, profiles):
+            if ok:
+                yield {'status': 'compiled', 'profile': profile, 'compileTime': compile_time,
+                       'binarySize': os.path.getsize(builds[profile][1])}
+            else:
+                failed = True
+                yield {'status': 'compile_error', 'profile': profile, 'message': 'Compilation failed', 'stderr': stderr}
+        if failed:
+            return
+
+        with lab_core() as cpu:
+            yield {'status': 'measuring', 'runs': lab['runs'], 'warmup': lab['warmup'], 'cpu': cpu}
+            samples = {profile: {'wallTime': [], 'cpuTime': []} for profile in profiles}
+            outputs = {}
+            errors = {}
+            for run in range(lab['warmup'] + lab['runs']):
+                for profile in profiles:
+                    if profile in errors:
+                        continue
+                    result = run_batch(builds[profile][1], stdin_data, stdin_path=stdin_path,
+                                       profile=profile, cpu=cpu)
+                    record_usage(user, 'cpu', result['cpuTime'] or 0)
+                    if result['timedOut'] or result['exitCode'] != 0:
+                        errors[profile] = 'Timed out' if result['timedOut'] else (
+                            f"Exited with code {result['exitCode']}" if result['exitCode'] is not None
+                            else f"Killed by signal {result['signal']}")
+                        yield {'status': 'run_error', 'profile': profile, 'error': errors[profile],
+                               'stderr': result['stderr'][:GRADE_STDERR_EXCERPT]}
+                        continue
+                    outputs.setdefault(profile, hashlib.sha256(result['stdout'].encode()).hexdigest())
+                    if run < lab['warmup']:
+                        continue
+                    samples[profile]['wallTime'].append(result['wallTime'])
+                    samples[profile]['cpuTime'].append(result['cpuTime'])
+                    yield {'profile': profile, 'run': run - lab['warmup'] + 1,
+                           'wallTime': result['wallTime'], 'cpuTime': result['cpuTime']}
+
+        results = {}
+        for profile in profiles:
+            results[profile] = {
+                'binarySize': os.path.getsize(builds[profile][1]),
+                'runs': len(samples[profile]['wallTime'])
+            }
+            if profile in errors:
+                results[profile]['error'] = errors[profile]
+            if samples[profile]['wallTime']:
+                results[profile]['wallTime'] = timing_summary(samples[profile]['wallTime'])
+                results[profile]['cpuTime'] = timing_summary(samples[profile]['cpuTime'])
+        # Builds that disagree usually mean undefined behaviour the optimizer exploited
+        yield {'status': 'measured', 'results': results, 'sameOutput': len(set(outputs.values())) <= 1}
+    except Exception as e:
+        yield {'error': str(e)}
+    finally:
+        for thread in list(pool.coroutines_running):
+            thread.kill()
+        for cpp_path, exe_path in builds.values():
+            remove_files(cpp_path, exe_path)
+
+@app.route('/lab', methods=['POST'])
+@executor_placed
+def performance_lab():
+    """Compare a program's speed and size under several build profiles (Server-Sent Events)"""
+    data = request.json
+    code, error = submitted_program(data)
+    lab, lab_error = submitted_lab(data)
+    if error or lab_error:
+        return jsonify({'error': error or lab_error}), 400
+
+    stdin_path = None
+    if 'stdinFile' in data:
+        stdin_path = input_file_path(data.get('stdinFile'))
+        if not stdin_path:
+            return jsonify({'error': 'Input file not found'}), 404
+
+    events = lab_events(code, lab, data.get('stdin') or '', stdin_path, request_user(data))
+    return Response(sse_frames(events), mimetype='text/event-stream')
+
+# Profiler: a build with gprof instrumentation (the `profiling` profile) runs once
+# under the batch limits and its gmon.out becomes a ranked list of the functions
+# and source lines where the time went. gprof samples the program counter every
+# 10 ms, so programs need to run for a while to show anything. Reports are kept in
+# the run cache per binary and input.
+GPROF = shutil.which('gprof')
+PROFILER_TOP = 20  # functions and lines reported
+PROFILER_TIMEOUT = 10  # seconds for gprof itself
+FLAT_PROFILE_ROW = re.compile(
+    r'\s*(?P<percent>[\d.]+)\s+[\d.]+\s+(?P<self>[\d.]+)'
+    r'(?:\s+(?P<calls>\d+)\s+[\d.]+\s+[\d.]+)?\s+(?P<name>\S.*)'
+)
+LINE_LOCATION = re.compile(r'(?P<function>.+) \((?P<file>[^()]+):(?P<line>\d+) @ [0-9a-f]+\)')
+SAMPLE_INTERVAL = re.compile(r'Each sample counts as ([\d.]+) seconds')
+
+def flat_profile(exe_path, gmon_path, by_line=False):
+    """gprof's flat profile as (sample interval, [(percent, self seconds, calls, name)])"""
+    proc = subprocess.run(
+        [GPROF, '-b', '-p'] + (['-l'] if by_line else []) + [exe_path, gmon_path],
+        capture_output=True, text=True, timeout=PROFILER_TIMEOUT
+    )
+    interval = SAMPLE_INTERVAL.search(proc.stdout)
+    rows = []
+    for line in proc.stdout.splitlines():
+        row = FLAT_PROFILE_ROW.fullmatch(line)
+        if row:
+            calls = int(row['calls']) if row['calls'] else None
+            rows.append((float(row['percent']), float(row['self']), calls, row['name'].strip()))
+    return float(interval.group(1)) if interval else None, rows
+
+def profile_report(exe_path, gmon_path, project_files):
+    """Hot functions and hot source lines of a profiled run. Units are compiled in
+    the project directory, so the debug info names them as project_files does; only
+    lines in those files are reported."""
+    interval, functions = flat_profile(exe_path, gmon_path)
+    _, lines = flat_profile(exe_path, gmon_path, by_line=True)
+
+    hot_lines = collections.defaultdict(lambda: {'selfTime': 0.0, 'percent': 0.0})
+    for percent, seconds, calls, name in lines:
+        location = LINE_LOCATION.fullmatch(name)
+        if not seconds or not location or os.path.basename(location['file']) not in project_files:
+            continue
+        # One line can span several addresses
+        entry = hot_lines[(os.path.basename(location['file']), int(location['line']))]
+        entry['function'] = location['function']
+        entry['selfTime'] += seconds
+        entry['percent'] += percent
+
+    ranked_lines = sorted(hot_lines.items(), key=lambda item: -item[1]['selfTime'])[:PROFILER_TOP]
+    return {
+        'sampleInterval': interval,
+        'sampledTime': round(sum(seconds for _, seconds, _, _ in functions), 4),
+        'hotFunctions': [
+            {'function': name, 'selfTime': seconds, 'percent': percent, 'calls': calls}
+            for percent, seconds, calls, name in functions[:PROFILER_TOP] if seconds or calls
+        ],
+        'hotLines': [
+            {'file': file, 'line': line, 'function': entry['function'],
+             'selfTime': round(entry['selfTime'], 4), 'percent': round(entry['percent'], 2)}
+            for (file, line), entry in ranked_lines
+        ]
+    }
+
+def profile_run(cpp_path, exe_path, stdin_data='', stdin_path=None, priority='interactive'):
+    """Run a profiling build of a project once and report where its time went, from
+    the run cache when this binary has already been profiled on this input"""
+    stdin_hash = file_digest(stdin_path) if stdin_path else hashlib.sha256(stdin_data.encode()).hexdigest()
+    key = hashlib.sha256(json.dumps(['profile', file_digest(exe_path), stdin_hash]).encode()).hexdigest()
+    path = run_cache_lookup(key, 'profileReplays') if RUN_CACHE else None
+    if path:
+        with open(path) as f:
+            return {**json.load(f), 'cached': True}
+
+    project_files = set(read_project(cpp_path))
+    work = tempfile.mkdtemp(suffix='.gmon')
+    try:
+        # gprof's runtime writes gmon.<pid> here when the program exits normally
+        result = run_batch(exe_path, stdin_data, stdin_path=stdin_path, profile='profiling',
+                           priority=priority, env={'GMON_OUT_PREFIX': os.path.join(work, 'gmon')})
+        dumps = sorted(name for name in os.listdir(work) if name.startswith('gmon.'))
+        if dumps:
+            report = profile_report(exe_path, os.path.join(work, dumps[0]), project_files)
+        else:
+            report = {'sampleInterval': None, 'sampledTime': 0.0, 'hotFunctions': [], 'hotLines': [],
+                      'message': 'No profile was written: the program has to return from main or call exit()'}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {**result, **report, 'cached': False}
+    if not report['hotFunctions'] and 'message' not in report:
+        report['message'] = 'The program ran too briefly to be sampled'
+    if RUN_CACHE and dumps:
+        run_cache_store(key, json.dumps(report).encode(), 'profileRecordings')
+    return report
+
+@app.route('/run/profile', methods=['POST'])
+@executor_placed
+def profile_program():
+    """Build with gprof instrumentation, run once on the given stdin and return the
+    hottest functions and source lines"""
+    data = request.json
+    code, error = submitted_program(data)
+    priority, priority_error = submitted_priority(data)
+    if error or priority_error:
+        return jsonify({'error': error or priority_error}), 400
+    if not GPROF:
+        return jsonify({'error': 'Profiling is not available on this server'}), 503
+
+    stdin_path = None
+    if 'stdinFile' in data:
+        stdin_path = input_file_path(data.get('stdinFile'))
+        if not stdin_path:
+            return jsonify({'error': 'Input file not found'}), 404
+
+    # Always built as a project: its units are compiled under their own names, so
+    # the file names in the debug info are the same for every cached build
+    cpp_path, exe_path = write_source(code if isinstance(code, dict) else {'main.cpp': code})
+    try:
+        user = request_user(data)
+        started = time.time()
+        with fair_share_slot(user, priority):
+            ok, stderr = compile_program(cpp_path, exe_path, 'profiling', priority)
+        build = {'profile': 'profiling', 'compileTime': round(time.time() - started, 3)}
+        if not ok:
+            return jsonify({'message': 'Compilation failed', 'stderr': stderr, **build}), 400
+
+        report = profile_run(cpp_path, exe_path, data.get('stdin') or '', stdin_path, priority)
+        if not report['cached']:
+            record_usage(user, 'cpu', report['cpuTime'] or 0)
+        return jsonify({**report, **build})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        remove_files(cpp_path, exe_path)
+
+PTY_READ_LIMIT = 65536  # bytes coalesced into one output frame
+
+def read_available(fd, limit=PTY_READ_LIMIT):
+    """Read whatever the PTY has buffered, up to limit bytes, without waiting for more"""
+    chunks = []
+    size = 0
+    try:
+        while size < limit and select.select([fd], [], [], 0)[0]:
+            data = os.read(fd, limit - size)
+            if not data:
+                break
+            chunks.append(data)
+            size += len(data)
+    except OSError:
+        pass  # EIO once the program has closed its end of the PTY
+    return b''.join(chunks)
+
+def session_chunks(session_id, stats=False):
+    """Yield raw output from a session's PTY until the program exits.
+    With stats, each new sample of the session's resource use is yielded too, as a dict."""
+    session = active_processes[session_id]
+    proc = session['proc']
+    fd = proc.fd
+    seq = session['stats_seq']
+
+    while True:
+        r, w, x = select.select([fd], [], [], 0.1)
+
+        if stats and session['stats_seq'] != seq:
+            seq = session['stats_seq']
+            yield dict(session['stats'])
+
+        if fd in r:
+            data = read_available(fd)
+            if data:
+                record_output(session, data)
+                yield data
+                continue
+
+        if not proc.isalive():
+            # Process finished, flush whatever is still buffered in the PTY
+            data = read_available(fd)
+            if data:
+                record_output(session, data)
+                yield data
+            finish_recording(session)
+            session['summary'] = session_summary(session)
+            break
+
+def session_summary(session):
+    """Wall time, CPU time, peak RSS and exit status of a finished session's program,
+    from the launcher's wait4 rusage, or from the last sample if it has none"""
+    try:
+        report = parse_launcher_report(os.read(session['report_fd'], 256))
+    except OSError:
+        report = None
+    summary = {
+        'wallTime': round(time.time() - session['created_at'], 3),
+        'cpuTime': session['stats']['cpuTime'],
+        'peakMemoryKb': session['stats']['peakRssKb'],
+        'exitCode': None,
+        'signal': None
+    }
+    if report:
+        status, cpu_time, peak_rss = report
+        summary['cpuTime'] = round(cpu_time, 3)
+        summary['peakMemoryKb'] = peak_rss
+        summary['exitCode'] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else None
+        summary['signal'] = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+        # Charge whatever ran since the last sample
+        if cpu_time > session['cpu_accounted']:
+            record_usage(session['user'], 'cpu', cpu_time - session['cpu_accounted'])
+            session['cpu_accounted'] = cpu_time
+    if session['heap_fd'] is not None:
+        try:
+            summary['heap'] = parse_heap_report(os.read(session['heap_fd'], 256))
+        except OSError:
+            summary['heap'] = None
+    return summary
+
+def record_output(session, data):
+    recording = session['recording']
+    if recording is None or recording['overflow']:
+        return
+    if len(recording['output']) + len(data) > RUN_CACHE_MAX_OUTPUT:
+        recording['overflow'] = True
+        recording['output'] = bytearray()
+    else:
+        recording['output'] += data
+
+def session_output(session_id):
+    """Yield SSE frames with a session's terminal output until the program exits"""
+    msg = 'Connected to terminal session...\r\n'
+    yield f"data: {json.dumps({'output': msg})}\n\n"
+
+    try:
+        # Multi-byte characters can be split across reads
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for data in session_chunks(session_id, stats=True):
+            if isinstance(data, dict):
+                yield f"event: stats\ndata: {json.dumps({'stats': data})}\n\n"
+                continue
+            output = decoder.decode(data)
+            if output:
+                yield f"data: {json.dumps({'output': output})}\n\n"
+
+        exit_msg = '\r\n\x1b[32mProgram exited.\x1b[0m\r\n'
+        summary = active_processes[session_id]['summary']
+        yield f"data: {json.dumps({'output': exit_msg, 'status': 'finished', 'summary': summary})}\n\n"
+
+    except Exception as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        # Cleanup
+        cleanup_session(session_id)
+
+def raw_session_output(session_id):
+    """Yield a session's raw PTY bytes, cleaning the session up at the end"""
+    try:
+        yield from session_chunks(session_id)
+    finally:
+        cleanup_session(session_id)
+
+@app.route('/output/<session_id>', methods=['GET'])
+@session_affine
+def get_output(session_id):
+    if session_id not in active_processes:
+        return jsonify({'error': 'Session not found'}), 404
+
+    # raw=1 streams the PTY bytes as they are, for relays like the socket terminal
+    if request.args.get('raw'):
+        return Response(raw_session_output(session_id), mimetype='application/octet-stream')
+    return Response(session_output(session_id), mimetype='text/event-stream')
+
+# Summaries of sessions already cleaned up, for relays that streamed their raw output
+FINISHED_SUMMARIES_SIZE = 1000
+finished_summaries = collections.OrderedDict()  # session id -> summary
+
+@app.route('/summary/<session_id>', methods=['GET'])
+def finished_session_summary(session_id):
+    """Summary of a session that finished on this process"""
+    if session_id not in finished_summaries:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'summary': finished_summaries[session_id]})
+
+@app.route('/stop/<session_id>', methods=['POST'])
+@session_affine
+def stop_session_http(session_id):
+    if session_id not in active_processes:
+        return jsonify({'error': 'Session not found'}), 404
+
+    cleanup_session(session_id)
+    return jsonify({'status': 'stopped'})
+
+@app.route('/input/<session_id>', methods=['POST'])
+@session_affine
+def send_input(session_id):
+    if session_id not in active_processes:
+        return jsonify({'error': 'Session not found'}), 404
+        
+    # Raw bytes as the body, or JSON {'input': text}
+    if request.mimetype == 'application/octet-stream':
+        input_data = request.get_data()
+    else:
+        input_data = request.json.get('input', '').encode()
+    
+    session = active_processes[session_id]
+    proc = session['proc']
+    
+    if proc.isalive():
+        accepted = queue_input(session_id, input_data)
+        return jsonify({
+            'status': 'ok',
+            'accepted': accepted,
+            'pending': session['input_pending']
+        })
+    else:
+        return jsonify({'error': 'Process finished'}), 400
+
+@app.route('/upload', methods=['POST'])
+def upload_input():
+    """Store a stdin file once so runs and sessions can reuse it by inputId"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    purge_uploads()
+
+    # Either a multipart 'file' field or the raw request body
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+
+    input_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_DIR, input_id)
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise ValueError('Input file too large')
+                f.write(chunk)
+    except ValueError as e:
+        os.remove(path)
+        return jsonify({'error': str(e), 'maxSize': MAX_UPLOAD_SIZE}), 413
+
+    return jsonify({'inputId': input_id, 'size': size})
+
+@app.route('/input/<session_id>/file', methods=['POST'])
+@session_affine
+def send_input_file(session_id):
+    """Stream an uploaded input file to a running session's stdin"""
+    if session_id not in active_processes:
+        return jsonify({'error': 'Session not found'}), 404
+
+    data = request.json
+    path = input_file_path(data.get('inputId'))
+    if not path:
+        return jsonify({'error': 'Input file not found'}), 404
+
+    if not active_processes[session_id]['proc'].isalive():
+        return jsonify({'error': 'Process finished'}), 400
+
+    size = queue_input_file(session_id, path)
+    return jsonify({'status': 'ok', 'size': size})
+
+def cleanup_session(session_id):
+    if session_id in active_processes:
+        session = active_processes[session_id]
+        proc = session['proc']
+        if session['input_writer'] is not None:
+            session['input_writer'].kill()
+        clear_input_queue(session)
+        if session['summary'] is None:
+            account_session(session)
+        else:
+            finished_summaries[session_id] = session['summary']
+            if len(finished_summaries) > FINISHED_SUMMARIES_SIZE:
+                finished_summaries.popitem(last=False)
+        # The program and anything it forked, not only the launcher, which stays
+        # alive to reap the program
+        for pid, sid, fields in session_processes({proc.pid}):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        proc.terminate(force=True)
+        os.close(session['report_fd'])
+        if session['heap_fd'] is not None:
+            os.close(session['heap_fd'])
+
+        remove_files(session['exe_path'], session['cpp_path'])
+
+        del active_processes[session_id]
+        session_registry.unregister(session_id)
+        if session['user']:
+            session_registry.release_user(session['user'], session_id)
+
+# WebSocket terminal: { socket sid: sessionId } for clients attached over Socket.IO
+terminal_clients = {}
+
+def output_chunks(session_id):
+    """Yield a session's raw output, whether it runs here or on another local process.
+    Returns the session's summary once it has finished, or None."""
+    if session_id in active_processes:
+        yield from session_chunks(session_id)
+        return active_processes[session_id]['summary'] if session_id in active_processes else None
+
+    address = session_owner_address(session_id)
+    if not address:
+        return None
+    conn, upstream = local_request(address, 'GET', f'/output/{session_id}?raw=1')
+    conn.sock.settimeout(None)  # Output can pause for as long as the program waits
+    try:
+        while True:
+            chunk = upstream.read1(PTY_READ_LIMIT)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        conn.close()
+    return relayed_summary(address, session_id)
+
+def relayed_summary(address, session_id):
+    """Summary the owner kept for a session whose raw output we relayed"""
+    try:
+        conn, response = local_request(address, 'GET', f'/summary/{session_id}', timeout=2)
+    except OSError:
+        return None
+    try:
+        if response.status != 200:
+            return None
+        return json.loads(response.read())['summary']
+    except (OSError, ValueError, KeyError):
+        return None
+    finally:
+        conn.close()
+
+def stop_session(session_id):
+    """Terminate a session, here or on the local process that owns it"""
+    if session_id in active_processes:
+        cleanup_session(session_id)
+        return
+
+    address = session_owner_address(session_id)
+    if address:
+        try:
+            conn, response = local_request(address, 'POST', f'/stop/{session_id}')
+            conn.close()
+        except OSError:
+            pass  # Owner is gone, and the session with it
+
+def write_session_input(session_id, data):
+    """Queue stdin for a session here or on its owner; returns the accepted byte count"""
+    if session_id in active_processes:
+        if not active_processes[session_id]['proc'].isalive():
+            return 0
+        return queue_input(session_id, data)
+
+    address = session_owner_address(session_id)
+    if not address:
+        return 0
+    try:
+        return json.loads(relay_input(address, session_id, data)).get('accepted', 0)
+    except (OSError, http.client.HTTPException, ValueError):
+        return 0
+
+# Kept-alive connections to owners for input relays, one keystroke frame per request
+idle_input_connections = collections.defaultdict(list)  # owner address -> connections
+
+def relay_input(address, session_id, data):
+    """POST stdin to the session's owner and return the reply body"""
+    pool = idle_input_connections[address]
+    while True:
+        reused = bool(pool)
+        conn = pool.pop() if reused else UnixHTTPConnection(address)
+        try:
+            conn.request('POST', f'/input/{session_id}', body=data, headers={
+                FORWARDED_HEADER: str(worker_id()),
+                'Content-Type': 'application/octet-stream'
+            })
+            body = conn.getresponse().read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            if reused:
+                continue  # The owner closed it while idle, try a fresh one
+            raise
+        pool.append(conn)
+        return body
+
+def attach_terminal(sid, session_id):
+    """Stream a session's PTY output to a Socket.IO client as binary frames"""
+    terminal_clients[sid] = session_id
+    try:
+        chunks = output_chunks(session_id)
+        while True:
+            try:
+                data = next(chunks)
+            except StopIteration as stop:
+                summary = stop.value
+                break
+            if terminal_clients.get(sid) != session_id:
+                return  # Client moved on to another run
+            socketio.emit('terminal_output', data, to=sid)
+        socketio.emit('terminal_event', {'status': 'finished', 'sessionId': session_id, 'summary': summary}, to=sid)
+    except Exception as e:
+        socketio.emit('terminal_event', {'error': str(e)}, to=sid)
+    finally:
+        if terminal_clients.get(sid) == session_id:
+            del terminal_clients[sid]
+        stop_session(session_id)
+
+def run_terminal(sid, code, profile, user, track_heap=False):
+    """Compile over the socket, then attach the new session to it"""
+    events = run_events(code, profile, user, track_heap)
+    while True:
+        try:
+            socketio.emit('terminal_event', next(events), to=sid)
+        except StopIteration as stop:
+            session_id = stop.value
+            break
+        except Exception as e:
+            socketio.emit('terminal_event', {'error': str(e)}, to=sid)
+            return
+
+    if session_id:
+        attach_terminal(sid, session_id)
+
+def detach_terminal(sid):
+    """Terminate the session a socket is attached to, if any"""
+    session_id = terminal_clients.pop(sid, None)
+    if session_id:
+        stop_session(session_id)
+
+@socketio.on('terminal_run')
+def handle_terminal_run(data):
+    code, error = submitted_program(data or {})
+    profile, profile_error = submitted_profile(data or {})
+    track_heap, heap_error = submitted_heap_tracking(data or {}, profile)
+    if error or profile_error or heap_error:
+        emit('terminal_event', {'error': error or profile_error or heap_error})
+        return
+
+    # One running program per socket, a new Run replaces the previous one
+    detach_terminal(request.sid)
+    socketio.start_background_task(run_terminal, request.sid, code, profile, request_user(data), track_heap)
+
+@socketio.on('terminal_attach')
+def handle_terminal_attach(data):
+    session_id = (data or {}).get('sessionId')
+    if session_id not in active_processes and not session_owner_address(session_id or ''):
+        emit('terminal_event', {'error': 'Session not found'})
+        return
+
+    detach_terminal(request.sid)
+    socketio.start_background_task(attach_terminal, request.sid, session_id)
+
+@socketio.on('terminal_input')
+def handle_terminal_input(data):
+    session_id = terminal_clients.get(request.sid)
+    if not session_id:
+        return 0
+
+    if isinstance(data, str):
+        data = data.encode()
+    return write_session_input(session_id, data)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    detach_terminal(request.sid)
 
 if __name__ == '__main__':
+    start_grade_job_watcher()
     print("Starting server on port 5550...")
     socketio.run(app, debug=True, host='0.0.0.0', port=5550)
\ No newline at end of file
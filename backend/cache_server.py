@@ -0,0 +1,103 @@
+"""Shared compile cache: a content-addressed blob store for the backend's L2 cache.
+
+Machines running app.py with L2_CACHE_URL set read builds through this store
+on a local miss and upload fresh builds in the background, so a program
+compiled on one machine is a cache hit on every other one. Blobs are named by
+the compile cache key and carry the sha256 of their content, which readers
+check before trusting a blob.
+
+    GET  /blobs/<key>   200 blob, X-Content-SHA256 (and X-Signature if stored)
+                        404 when absent
+    PUT  /blobs/<key>   body is the blob, X-Content-SHA256 required
+                        201 stored, 400 on a digest mismatch
+    GET  /health
+
+    python cache_server.py --port 7200     # stand-in for a shared store
+"""
+from flask import Flask, request, jsonify, Response
+import hashlib
+import json
+import os
+import re
+import sys
+
+app = Flask(__name__)
+
+BLOB_DIR = os.environ.get('BLOB_DIR', '/tmp/cpp_blob_cache')
+MAX_BLOB_SIZE = 64 * 1024 * 1024  # bytes
+MAX_BLOBS = 5000
+DEFAULT_PORT = 7200
+
+KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+def blob_path(key):
+    return os.path.join(BLOB_DIR, key)
+
+def evict_blobs():
+    """Drop the least recently used blobs once the store holds too many"""
+    entries = [e for e in os.scandir(BLOB_DIR) if KEY_PATTERN.fullmatch(e.name)]
+    if len(entries) <= MAX_BLOBS:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - MAX_BLOBS]:
+        for path in (entry.path, f'{entry.path}.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+@app.route('/blobs/<key>', methods=['GET'])
+def get_blob(key):
+    if not KEY_PATTERN.fullmatch(key):
+        return jsonify({'error': 'Invalid key'}), 400
+    try:
+        with open(f'{blob_path(key)}.json') as f:
+            meta = json.load(f)
+        with open(blob_path(key), 'rb') as f:
+            blob = f.read()
+    except (OSError, ValueError):
+        stats['misses'] += 1
+        return jsonify({'error': 'Not found'}), 404
+
+    os.utime(blob_path(key))
+    stats['hits'] += 1
+    headers = {'X-Content-SHA256': meta['sha256']}
+    if meta.get('signature'):
+        headers['X-Signature'] = meta['signature']
+    return Response(blob, mimetype='application/octet-stream', headers=headers)
+
+@app.route('/blobs/<key>', methods=['PUT'])
+def put_blob(key):
+    if not KEY_PATTERN.fullmatch(key):
+        return jsonify({'error': 'Invalid key'}), 400
+    if (request.content_length or 0) > MAX_BLOB_SIZE:
+        return jsonify({'error': 'Blob too large'}), 413
+
+    blob = request.get_data()
+    digest = request.headers.get('X-Content-SHA256', '')
+    if hashlib.sha256(blob).hexdigest() != digest:
+        return jsonify({'error': 'Digest mismatch'}), 400
+
+    # Write to temp names and rename, so readers never see half a blob
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    tmp = f'{blob_path(key)}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(blob)
+    os.replace(tmp, blob_path(key))
+    with open(f'{tmp}.json', 'w') as f:
+        json.dump({'sha256': digest, 'signature': request.headers.get('X-Signature', '')}, f)
+    os.replace(f'{tmp}.json', f'{blob_path(key)}.json')
+
+    stats['stores'] += 1
+    evict_blobs()
+    return jsonify({'status': 'stored'}), 201
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'healthy', **stats})
+
+if __name__ == '__main__':
+    port = int(sys.argv[sys.argv.index('--port') + 1]) if '--port' in sys.argv else DEFAULT_PORT
+    app.run(host='0.0.0.0', port=port, threaded=True)
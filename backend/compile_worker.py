@@ -0,0 +1,164 @@
+"""Compile worker: a small HTTP service that compiles C++ for the backend.
+
+The backend (app.py) spreads compiles over the workers listed in
+COMPILE_WORKERS by consistent hashing on the source, so the same program
+always lands on the same worker and hits its cache.
+
+    POST /compile  {"source": "...", "flags": ["-std=c++17"]}
+        200 {"ok": true,  "stderr": "<warnings>", "binary": "<base64>", "compileTime": 0.8, "cached": false}
+        422 {"ok": false, "stderr": "<diagnostics>"}
+    GET /health
+
+    gunicorn -w 2 -b 0.0.0.0:7100 compile_worker:app   # one worker node
+    python compile_worker.py --port 7101                # single process, for development
+    python compile_worker.py --local 3                  # stand-in pool on ports 7101-7103
+"""
+from flask import Flask, request, jsonify
+import base64
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+app = Flask(__name__)
+
+CACHE_DIR = os.environ.get('COMPILE_CACHE_DIR', '/tmp/cpp_worker_cache')
+COMPILE_TIMEOUT = 10  # seconds
+COMPILE_MEMORY_LIMIT = int(os.environ.get('COMPILE_MEMORY_LIMIT', 768 * 1024 * 1024))  # bytes of address space
+LOCAL_BASE_PORT = 7101
+
+# Only flags the backend actually sends, so a worker can't be told to read or write arbitrary paths
+ALLOWED_FLAG = re.compile(
+    r'-std=(c|gnu)\+\+(11|14|17|20|23)'
+    r'|-O[0-3s]|-g|-pipe|-Wall|-Wextra'
+    r'|-fsanitize=(address|undefined)(,(address|undefined))*'
+    r'|-fno-omit-frame-pointer|-pg'
+    r'|-fuse-ld=(gold|lld|mold)'
+)
+
+stats = {'compiles': 0, 'cacheHits': 0}
+
+def cache_key(source, flags):
+    return hashlib.sha256(json.dumps([flags, source]).encode()).hexdigest()
+
+def load_cached(key):
+    """Cached result for a key, or None"""
+    meta_path = os.path.join(CACHE_DIR, f'{key}.json')
+    binary_path = os.path.join(CACHE_DIR, key)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(binary_path, 'rb') as f:
+            binary = f.read()
+    except (OSError, ValueError):
+        return None
+    return meta, binary
+
+def store_cached(key, meta, binary_path):
+    """Store a compiled binary, atomically so concurrent readers never see half a file"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    target = os.path.join(CACHE_DIR, key)
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(binary_path, 'rb') as src, open(tmp, 'wb') as dst:
+        dst.write(src.read())
+    os.replace(tmp, target)
+
+    meta_tmp = f'{target}.json.{os.getpid()}.tmp'
+    with open(meta_tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_tmp, f'{target}.json')
+
+@app.route('/compile', methods=['POST'])
+def compile_source():
+    data = request.json
+    source = data.get('source', '')
+    flags = data.get('flags', [])
+
+    if not source:
+        return jsonify({'error': 'No source provided'}), 400
+    rejected = [flag for flag in flags if not ALLOWED_FLAG.fullmatch(flag)]
+    if rejected:
+        return jsonify({'error': f'Flags not allowed: {rejected}'}), 400
+
+    key = cache_key(source, flags)
+    cached = load_cached(key)
+    if cached:
+        meta, binary = cached
+        stats['cacheHits'] += 1
+        return jsonify({
+            'ok': True,
+            'stderr': meta['stderr'],
+            'binary': base64.b64encode(binary).decode(),
+            'compileTime': meta['compileTime'],
+            'cached': True
+        })
+
+    stats['compiles'] += 1
+    started = time.time()
+    with tempfile.TemporaryDirectory() as work:
+        cpp_path = os.path.join(work, 'main.cpp')
+        exe_path = os.path.join(work, 'main')
+        with open(cpp_path, 'w') as f:
+            f.write(source)
+
+        try:
+            proc = subprocess.run(
+                # Relative names keep the temp dir out of the diagnostics; the limit
+                # is inherited by cc1plus and the linker
+                ['prlimit', f'--as={COMPILE_MEMORY_LIMIT}', '--',
+                 'g++', 'main.cpp', '-o', 'main', '-fdiagnostics-color=never'] + flags,
+                capture_output=True,
+                text=True,
+                timeout=COMPILE_TIMEOUT,
+                cwd=work
+            )
+        except subprocess.TimeoutExpired:
+            return jsonify({'ok': False, 'stderr': f'Compilation timed out after {COMPILE_TIMEOUT} seconds\n'}), 422
+
+        if proc.returncode != 0:
+            return jsonify({'ok': False, 'stderr': proc.stderr}), 422
+
+        compile_time = round(time.time() - started, 3)
+        store_cached(key, {'stderr': proc.stderr, 'compileTime': compile_time}, exe_path)
+        with open(exe_path, 'rb') as f:
+            binary = f.read()
+
+    return jsonify({
+        'ok': True,
+        'stderr': proc.stderr,
+        'binary': base64.b64encode(binary).decode(),
+        'compileTime': compile_time,
+        'cached': False
+    })
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'healthy', **stats})
+
+def run_local_pool(count):
+    """Stand-in pool for testing: one worker process per port, each with its own cache"""
+    children = []
+    for i in range(count):
+        port = LOCAL_BASE_PORT + i
+        env = dict(os.environ, COMPILE_CACHE_DIR=f'{CACHE_DIR}/{port}')
+        children.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--port', str(port)], env=env))
+
+    urls = ','.join(f'http://127.0.0.1:{LOCAL_BASE_PORT + i}' for i in range(count))
+    print(f'COMPILE_WORKERS={urls}')
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+
+if __name__ == '__main__':
+    if '--local' in sys.argv:
+        run_local_pool(int(sys.argv[sys.argv.index('--local') + 1]))
+    else:
+        port = int(sys.argv[sys.argv.index('--port') + 1]) if '--port' in sys.argv else LOCAL_BASE_PORT
+        app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,59 @@
+"""Executor daemons for the split deployment.
+
+The HTTP front (app.py with ROLE=front) only serves HTTP/SSE and the socket
+terminal. Compiling, PTY sessions and program I/O happen in executor daemons,
+one per core, each serving the same app on its own Unix socket in
+/tmp/cpp_executors. The front places new runs on the least loaded executor,
+and session requests reach their executor through the session registry.
+
+    python executor.py            # supervise EXECUTOR_COUNT executors (default: one per core)
+    python executor.py --serve    # run a single executor in the foreground
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+EXECUTOR_COUNT = int(os.environ.get('EXECUTOR_COUNT') or os.cpu_count() or 1)
+EXECUTOR_SOCKET_DIR = '/tmp/cpp_executors'  # Must match app.py
+RESTART_DELAY = 1  # seconds between liveness checks
+
+def spawn_executor():
+    env = dict(os.environ, ROLE='executor')
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'], env=env)
+
+def supervise():
+    """Keep EXECUTOR_COUNT executors running, restarting any that die"""
+    children = [spawn_executor() for _ in range(EXECUTOR_COUNT)]
+    print(f"Started {EXECUTOR_COUNT} executors: {[child.pid for child in children]}")
+
+    def shutdown(signum, frame):
+        for child in children:
+            child.terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while True:
+        time.sleep(RESTART_DELAY)
+        for i, child in enumerate(children):
+            if child.poll() is None:
+                continue
+            print(f"Executor {child.pid} exited with {child.returncode}, restarting")
+            # Its sessions died with it, stop the front from placing work there
+            stale = os.path.join(EXECUTOR_SOCKET_DIR, f'{child.pid}.sock')
+            if os.path.exists(stale):
+                os.remove(stale)
+            children[i] = spawn_executor()
+
+def serve():
+    import app
+    app.serve_executor()
+
+if __name__ == '__main__':
+    if '--serve' in sys.argv:
+        serve()
+    else:
+        supervise()
@@ -0,0 +1,93 @@
+/*
+ * Resource-limited launcher for student programs.
+ *
+ * usage: launcher <report_fd> <cpu_seconds> <address_space_bytes> <program> [args...]
+ *
+ * Forks, applies the limits in the child and execs the program, then reaps it
+ * with wait4 and writes "<wait_status> <utime_us> <stime_us> <maxrss_kb>\n" to
+ * report_fd. The program is forked from this small process rather than from
+ * the Python server so ru_maxrss reflects the program and not the server.
+ * The launcher exits the same way the program did.
+ */
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/resource.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+static pid_t child = -1;
+
+static void forward(int sig)
+{
+    if (child > 0)
+        kill(child, sig);
+}
+
+int main(int argc, char **argv)
+{
+    if (argc < 5) {
+        fprintf(stderr, "usage: %s report_fd cpu_seconds as_bytes program [args...]\n", argv[0]);
+        return 125;
+    }
+
+    int report_fd = atoi(argv[1]);
+    rlim_t cpu = strtoull(argv[2], NULL, 10);
+    rlim_t as = strtoull(argv[3], NULL, 10);
+
+    child = fork();
+    if (child < 0) {
+        perror("fork");
+        return 126;
+    }
+
+    if (child == 0) {
+        struct rlimit rl;
+        if (report_fd >= 0)
+            close(report_fd);
+        if (cpu > 0) {
+            rl.rlim_cur = cpu;
+            rl.rlim_max = cpu + 1;
+            setrlimit(RLIMIT_CPU, &rl);
+        }
+        if (as > 0) {
+            rl.rlim_cur = rl.rlim_max = as;
+            setrlimit(RLIMIT_AS, &rl);
+        }
+        rl.rlim_cur = rl.rlim_max = 0;
+        setrlimit(RLIMIT_CORE, &rl);
+        execv(argv[4], argv + 4);
+        perror("execv");
+        _exit(127);
+    }
+
+    signal(SIGTERM, forward);
+    signal(SIGINT, forward);
+    signal(SIGHUP, forward);
+
+    int status;
+    struct rusage ru;
+    while (wait4(child, &status, 0, &ru) < 0) {
+        /* Interrupted by a forwarded signal, keep waiting */
+    }
+
+    if (report_fd >= 0) {
+        char line[128];
+        int n = snprintf(line, sizeof(line), "%d %ld %ld %ld\n", status,
+                         (long)ru.ru_utime.tv_sec * 1000000L + ru.ru_utime.tv_usec,
+                         (long)ru.ru_stime.tv_sec * 1000000L + ru.ru_stime.tv_usec,
+                         ru.ru_maxrss);
+        if (write(report_fd, line, n) < 0) {
+            /* Nobody is listening, nothing else to do */
+        }
+        close(report_fd);
+    }
+
+    if (WIFSIGNALED(status)) {
+        signal(WTERMSIG(status), SIG_DFL);
+        kill(getpid(), WTERMSIG(status));
+    }
+    return WIFEXITED(status) ? WEXITSTATUS(status) : 1;
+}
@@ -1,5 +1,13 @@
 const API_URL = 'https://backend-snowy-wildflower-8765.fly.dev';
 const STORAGE_KEY = 'cpp_playground_files';
+const PROFILE_KEY = 'cpp_playground_profile';
+const INPUT_BATCH_MS = 5; // Keystrokes typed within this window go out as one frame
+const INPUT_RETRY_MS = 100;
+const SOURCE_FILE = /^[A-Za-z0-9_][A-Za-z0-9_.-]*\.(cpp|cc|cxx)$/;
+const HEADER_FILE = /^[A-Za-z0-9_][A-Za-z0-9_.-]*\.(h|hpp|hh|hxx)$/;
+const DEFINES_MAIN = /\bmain\s*\(/;
+const SPECULATIVE_COMPILE_MS = 1500; // Idle time after an edit before the buffer is built ahead of Run
+const LINT_DELAY_MS = 500;
 
 let editor;
 let files = [];
@@ -7,7 +15,15 @@ let activeFileId = null;
 let term;
 let fitAddon;
 let sessionId = null;
-let outputEventSource = null;
+let runController = null;
+let terminalSocket = null;
+let socketRun = false;
+let pendingInput = '';
+let inputFlushTimer = null;
+let speculativeTimer = null;
+let lastSpeculativeBody = '';
+let lintTimer = null;
+let lintMarks = [];
 let lastError = '';
 let userSessionId = localStorage.getItem('userSessionId') || generateId();
 let currentQuota = 3;
@@ -40,6 +56,8 @@ function init() {
         fitAddon.fit();
     });
 
+    connectTerminalSocket();
+
     // Load files from storage
     const saved = localStorage.getItem(STORAGE_KEY);
     if (saved) {
@@ -88,6 +106,8 @@ int main() {
                 saveToStorage();
             }
         }
+        scheduleSpeculativeCompile();
+        scheduleLint();
     });
 
     activeFileId = files[0].id;
@@ -98,6 +118,12 @@ int main() {
     // Event Listeners
     document.getElementById('newFileBtn').addEventListener('click', openNewFileModal);
     document.getElementById('runBtn').addEventListener('click', runCode);
+    const profileSelect = document.getElementById('profileSelect');
+    profileSelect.value = localStorage.getItem(PROFILE_KEY) || 'quick';
+    profileSelect.addEventListener('change', () => {
+        localStorage.setItem(PROFILE_KEY, profileSelect.value);
+        scheduleSpeculativeCompile();
+    });
     document.getElementById('clearOutputBtn').addEventListener('click', clearOutput);
     document.getElementById('cancelBtn').addEventListener('click', closeNewFileModal);
     document.getElementById('createBtn').addEventListener('click', createNewFile);
@@ -256,6 +282,113 @@ int main() {
     closeNewFileModal();
 }
 
+// The active file plus the headers and main-less sources beside it. Other files
+// with their own main() are separate programs and stay out of the build.
+function runPayload(code) {
+    const profile = document.getElementById('profileSelect').value;
+    // ASan brings its own allocator, the server refuses the two together
+    const trackHeap = document.getElementById('trackHeap').checked && profile !== 'sanitize';
+    const active = files.find(f => f.id === activeFileId);
+    if (!active || !SOURCE_FILE.test(active.name)) {
+        return { code: code, profile: profile, trackHeap: trackHeap, userSessionId: userSessionId };
+    }
+
+    const project = { [active.name]: code };
+    files.forEach(file => {
+        if (file === active) return;
+        if (HEADER_FILE.test(file.name) || (SOURCE_FILE.test(file.name) && !DEFINES_MAIN.test(file.content))) {
+            project[file.name] = file.content;
+        }
+    });
+    const program = Object.keys(project).length > 1 ? { files: project } : { code: code };
+    return { ...program, profile: profile, trackHeap: trackHeap, userSessionId: userSessionId };
+}
+
+function scheduleSpeculativeCompile() {
+    clearTimeout(speculativeTimer);
+    speculativeTimer = setTimeout(speculativeCompile, SPECULATIVE_COMPILE_MS);
+}
+
+// Build the buffer into the server's compile cache while the student pauses
+function speculativeCompile() {
+    const code = editor.getValue();
+    if (!code.trim()) return;
+
+    const body = JSON.stringify(runPayload(code));
+    if (body === lastSpeculativeBody) return;
+    lastSpeculativeBody = body;
+
+    fetch(`${API_URL}/compile/speculative`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: body
+    }).catch(() => {
+        // Only a head start, Run compiles anyway
+    });
+}
+
+function scheduleLint() {
+    clearTimeout(lintTimer);
+    lintTimer = setTimeout(lintCode, LINT_DELAY_MS);
+}
+
+function clearLintMarks() {
+    lintMarks.forEach(mark => mark.clear());
+    lintMarks = [];
+}
+
+// Syntax-check the buffer and mark its diagnostics inline
+async function lintCode() {
+    const code = editor.getValue();
+    const active = files.find(f => f.id === activeFileId);
+    if (!code.trim() || !active) {
+        clearLintMarks();
+        return;
+    }
+
+    const payload = runPayload(code);
+    const fileName = payload.files ? active.name : 'main.cpp';
+
+    let result;
+    try {
+        const response = await fetch(`${API_URL}/lint`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(payload)
+        });
+        // 409: a newer check replaced this one
+        if (!response.ok) return;
+        result = await response.json();
+    } catch (err) {
+        return;
+    }
+
+    // The buffer moved on while the check ran
+    if (editor.getValue() !== code || activeFileId !== active.id) return;
+
+    clearLintMarks();
+    result.diagnostics
+        .filter(d => d.file === fileName && d.line)
+        .forEach(d => {
+            const from = { line: d.line - 1, ch: Math.max(d.column - 1, 0) };
+            let to;
+            if (d.endLine) {
+                to = { line: d.endLine - 1, ch: d.endColumn };
+            } else {
+                to = editor.findWordAt(from).head;
+                if (to.ch <= from.ch) to = { line: from.line, ch: from.ch + 1 };
+            }
+            lintMarks.push(editor.markText(from, to, {
+                className: d.severity === 'error' ? 'lint-error' : 'lint-warning',
+                title: d.message
+            }));
+        });
+}
+
 async function runCode() {
     const code = editor.getValue();
 
@@ -266,89 +399,205 @@ async function runCode() {
 
     term.reset();
     term.write('Compiling and executing...\r\n');
+    clearTimeout(speculativeTimer);
 
     // Close existing session if any
-    if (outputEventSource) {
-        outputEventSource.close();
-        outputEventSource = null;
+    if (runController) {
+        runController.abort();
+        runController = null;
+    }
+    sessionId = null;
+    pendingInput = '';
+
+    // Prefer the WebSocket terminal, the server replaces any previous run on it
+    socketRun = Boolean(terminalSocket && terminalSocket.connected);
+    if (socketRun) {
+        terminalSocket.emit('terminal_run', runPayload(code));
+        return;
     }
 
+    const controller = new AbortController();
+    runController = controller;
+
     try {
-        const response = await fetch(`${API_URL}/run`, {
+        // Compile progress, diagnostics and program output all arrive on this one response
+        const response = await fetch(`${API_URL}/run/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ code: code })
+            body: JSON.stringify(runPayload(code)),
+            signal: controller.signal
         });
 
         if (!response.ok) {
             const error = await response.json();
-            // Display stderr if available, otherwise show the generic message
-            const errorOutput = error.stderr || error.output || error.message || 'Failed to start execution';
-            term.write(`\r\n\x1b[31mError: ${error.message}\x1b[0m\r\n`);
-            if (error.stderr || error.output) {
-                term.write(`\x1b[31m${errorOutput}\x1b[0m\r\n`);
-                lastError = errorOutput; // Store for AI debugging
-            }
+            term.write(`\r\n\x1b[31mError: ${error.error || error.message || 'Failed to start execution'}\x1b[0m\r\n`);
             return;
         }
 
-        const data = await response.json();
-        sessionId = data.sessionId;
-
-        // Start listening for output via SSE
-        startOutputListener(sessionId);
+        await readEventStream(response, handleRunEvent);
 
     } catch (err) {
-        term.write(`\r\n\x1b[31mConnection Error: ${err.message}\x1b[0m\r\n`);
-        lastError = err.message;
+        if (err.name !== 'AbortError') {
+            term.write(`\r\n\x1b[31mConnection Error: ${err.message}\x1b[0m\r\n`);
+            lastError = err.message;
+        }
+    } finally {
+        if (runController === controller) {
+            runController = null;
+            sessionId = null;
+        }
     }
 }
 
-function startOutputListener(sid) {
-    outputEventSource = new EventSource(`${API_URL}/output/${sid}`);
+function handleRunEvent(data) {
+    if (data.diagnostic) {
+        term.write(`\x1b[31m${data.diagnostic.replace(/\n/g, '\r\n')}\x1b[0m`);
+    }
+    if (data.status === 'compiled') {
+        const cached = data.cached ? ', cached' : '';
+        term.write(`\x1b[90mCompiled (${data.profile}) in ${data.compileTime}s${cached}\x1b[0m\r\n`);
+    }
+    if (data.status === 'compile_error') {
+        term.write(`\r\n\x1b[31mError: ${data.message}\x1b[0m\r\n`);
+        lastError = data.stderr; // Store for AI debugging
+    }
+    if (data.sessionId) {
+        sessionId = data.sessionId;
+    }
+    if (data.output) {
+        term.write(data.output);
+    }
+    if (data.error) {
+        term.write(`\r\n\x1b[31mError: ${data.error}\x1b[0m\r\n`);
+    }
+    if (data.status === 'finished') {
+        sessionId = null;
+        if (data.summary) {
+            const s = data.summary;
+            const exit = s.signal ? `signal ${s.signal}` : `exit code ${s.exitCode}`;
+            const memory = (s.peakMemoryKb / 1024).toFixed(1);
+            term.write(`\x1b[90m${exit}, ${s.wallTime}s wall, ${s.cpuTime}s CPU, ${memory} MB peak memory\x1b[0m\r\n`);
+        }
+        if (data.summary && data.summary.heap) {
+            const h = data.summary.heap;
+            const peak = (h.peakBytes / 1024).toFixed(1);
+            const leak = h.leakedBytes ? `\x1b[33m${h.leakedBytes} bytes leaked in ${h.leakedBlocks} blocks` : 'no leaks';
+            term.write(`\x1b[90mHeap: ${peak} KB peak, ${h.allocations} allocations, ${h.frees} frees, ${leak}\x1b[0m\r\n`);
+        }
+    }
+}
 
-    outputEventSource.onmessage = (event) => {
-        try {
-            const data = JSON.parse(event.data);
-            if (data.output) {
-                term.write(data.output);
-            }
-            if (data.status === 'finished') {
-                outputEventSource.close();
-                outputEventSource = null;
-                sessionId = null;
+async function readEventStream(response, onEvent) {
+    // EventSource can only GET, so parse the SSE frames of a POST response by hand
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            const payload = frame.split('\n')
+                .filter(line => line.startsWith('data: '))
+                .map(line => line.slice(6))
+                .join('\n');
+            if (!payload) continue;
+
+            try {
+                onEvent(JSON.parse(payload));
+            } catch (e) {
+                console.error('Error parsing stream data:', e);
             }
-        } catch (e) {
-            console.error('Error parsing SSE data:', e);
         }
-    };
+    }
+}
 
-    outputEventSource.onerror = (err) => {
-        console.error('SSE Error:', err);
-        outputEventSource.close();
-        outputEventSource = null;
-        sessionId = null;
-    };
+function connectTerminalSocket() {
+    if (typeof io === 'undefined') {
+        return; // Socket.IO client not loaded, stay on HTTP
+    }
+
+    terminalSocket = io(API_URL, { transports: ['websocket'] });
+
+    terminalSocket.on('terminal_event', (data) => {
+        if (socketRun) {
+            handleRunEvent(data);
+        }
+    });
+
+    terminalSocket.on('terminal_output', (data) => {
+        if (socketRun) {
+            term.write(new Uint8Array(data));
+        }
+    });
+
+    terminalSocket.on('disconnect', () => {
+        if (socketRun && sessionId) {
+            term.write('\r\n\x1b[31mConnection lost.\x1b[0m\r\n');
+        }
+        if (socketRun) {
+            sessionId = null;
+        }
+    });
 }
 
-async function sendInput(data) {
+function sendInput(data) {
     if (!sessionId) return;
 
+    pendingInput += data;
+    if (!inputFlushTimer) {
+        inputFlushTimer = setTimeout(flushInput, INPUT_BATCH_MS);
+    }
+}
+
+async function flushInput() {
+    inputFlushTimer = null;
+    const data = pendingInput;
+    pendingInput = '';
+    if (!data || !sessionId) return;
+
+    const encoded = new TextEncoder().encode(data);
+
+    if (socketRun) {
+        terminalSocket.emit('terminal_input', encoded, (accepted) => requeueInput(encoded, accepted));
+        return;
+    }
+
     try {
-        await fetch(`${API_URL}/input/${sessionId}`, {
+        const response = await fetch(`${API_URL}/input/${sessionId}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({ input: data })
         });
+        if (response.ok) {
+            const result = await response.json();
+            requeueInput(encoded, result.accepted);
+        }
     } catch (err) {
         console.error('Error sending input:', err);
     }
 }
 
+function requeueInput(encoded, accepted) {
+    // The server's input queue was full, send the rest once it has drained a bit
+    if (typeof accepted !== 'number' || accepted >= encoded.length || !sessionId) return;
+
+    pendingInput = new TextDecoder().decode(encoded.slice(accepted)) + pendingInput;
+    if (!inputFlushTimer) {
+        inputFlushTimer = setTimeout(flushInput, INPUT_RETRY_MS);
+    }
+}
+
 function clearOutput() {
     term.reset();
 }